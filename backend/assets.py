@@ -0,0 +1,103 @@
+# assets.py
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from ffmpeg_utils import ffprobe_info
+
+# content-addressed store: assets/<first 2 hex chars>/<sha256>
+ASSETS_DIR = Path("assets")
+ASSETS_DIR.mkdir(exist_ok=True)
+
+_sha_re = re.compile(r"^[0-9a-f]{64}$")
+_lock = threading.Lock()
+
+
+def valid_hash(sha: str) -> bool:
+    return bool(sha) and bool(_sha_re.match(sha))
+
+
+def asset_path(sha: str) -> Path:
+    return ASSETS_DIR / sha[:2] / sha
+
+
+def _meta_path(sha: str) -> Path:
+    return ASSETS_DIR / sha[:2] / f"{sha}.json"
+
+
+def has(sha: str) -> bool:
+    return valid_hash(sha) and asset_path(sha).exists()
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def ingest(path: Path, sha: Optional[str] = None) -> str:
+    """
+    Move a file into the store under its content hash. If the content is
+    already stored, the incoming copy is dropped. Returns the hash.
+    """
+    path = Path(path)
+    sha = sha or hash_file(path)
+    target = asset_path(sha)
+    with _lock:
+        if target.exists():
+            path.unlink()
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            path.replace(target)
+            os.chmod(target, 0o444)
+    return sha
+
+
+def link_into(sha: str, target: Path) -> Path:
+    """
+    Make an asset visible inside a job folder: hardlink, else symlink,
+    else (different filesystem without symlink support) a plain copy.
+    """
+    src = asset_path(sha)
+    if not src.exists():
+        raise KeyError(sha)
+    target = Path(target)
+    if target.exists() or target.is_symlink():
+        target.unlink()
+    try:
+        os.link(src, target)
+    except OSError:
+        try:
+            os.symlink(src.resolve(), target)
+        except OSError:
+            shutil.copy2(src, target)
+    return target
+
+
+def metadata(sha: str) -> Optional[Dict[str, Any]]:
+    """
+    Size plus cached ffprobe info for an asset; probed once, then read
+    from the sidecar json.
+    """
+    if not has(sha):
+        return None
+    mpath = _meta_path(sha)
+    if mpath.exists():
+        try:
+            return json.loads(mpath.read_text())
+        except Exception:
+            pass
+    src = asset_path(sha)
+    meta = {"sha256": sha, "size": src.stat().st_size, "probe": ffprobe_info(src)}
+    if meta["probe"] is not None:
+        tmp = mpath.with_suffix(".tmp")
+        tmp.write_text(json.dumps(meta))
+        tmp.replace(mpath)
+    return meta
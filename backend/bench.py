@@ -0,0 +1,405 @@
+# bench.py
+#
+# Offline benchmark suite. Generates synthetic inputs with ffmpeg's lavfi
+# test sources, starts the API (with its render workers) in a scratch
+# directory and measures:
+#  - renders: a sweep over video length x resolution x overlay count x
+#    overlay type, recording wall time and the job's own stage timings,
+#    realtime factor, fps and output bitrate
+#  - API latency: concurrent uploads + status polls at several
+#    concurrency levels
+# Results go to a JSON report; `compare` diffs two reports and exits
+# non-zero on regressions, so runs from different commits can be checked
+# offline.
+#
+#   python bench.py run --out report.json
+#   python bench.py run --lengths 10,60 --resolutions 640x360,1920x1080 \
+#       --overlays 0,4,16 --types text,image,video --concurrency 1,8,32
+#   python bench.py compare baseline.json report.json --threshold 0.10
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent
+INPUTS_DIR = BACKEND_DIR / "bench_inputs"
+RUNS_DIR = BACKEND_DIR / "bench_runs"
+
+FINAL_STATUSES = ("done", "error", "cancelled", "expired")
+# job fields copied into the report for each render point
+JOB_FIELDS = ("render_mode_used", "timings", "realtime_factor", "avg_fps", "speed",
+              "output_bitrate_kbps", "output_bytes", "msg")
+
+
+# ------------------------------
+# SYNTHETIC INPUTS
+# ------------------------------
+
+def ffmpeg(*args: str):
+    subprocess.run(["ffmpeg", "-y", "-v", "error", *args], check=True)
+
+
+def make_video(length: float, size: str) -> Path:
+    path = INPUTS_DIR / f"base_{size}_{length:g}s.mp4"
+    if not path.exists():
+        ffmpeg(
+            "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30",
+            "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+            "-t", f"{length:g}", "-c:v", "libx264", "-preset", "veryfast", "-g", "60",
+            "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", str(path),
+        )
+    return path
+
+
+def make_image(size: str) -> Path:
+    path = INPUTS_DIR / f"overlay_{size}.png"
+    if not path.exists():
+        ffmpeg("-f", "lavfi", "-i", f"testsrc=size={size}", "-frames:v", "1", str(path))
+    return path
+
+
+def make_clip(size: str, length: float) -> Path:
+    path = INPUTS_DIR / f"clip_{size}_{length:g}s.mp4"
+    if not path.exists():
+        ffmpeg(
+            "-f", "lavfi", "-i", f"smptebars=size={size}:rate=30", "-t", f"{length:g}",
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", str(path),
+        )
+    return path
+
+
+def build_overlays(kind: str, count: int, length: float, size: str):
+    """
+    count overlays of kind (text / image / video / mixed) spread over the
+    frame and the timeline. Returns (overlays, {filename: path}).
+    """
+    w, h = (int(v) for v in size.split("x"))
+    ow, oh = max(16, w // 8), max(16, h // 8)
+    kinds = ["text", "image", "video"] if kind == "mixed" else [kind]
+    overlays, files = [], {}
+    for i in range(count):
+        k = kinds[i % len(kinds)]
+        start = round(length * i / max(1, count) * 0.5, 3)
+        ov = {
+            "id": f"ov{i}",
+            "type": k,
+            "x": (i * ow) % max(1, w - ow),
+            "y": ((i * ow) // max(1, w - ow) * oh) % max(1, h - oh),
+            "start_time": start,
+            "end_time": round(min(length, start + length / 2), 3),
+        }
+        if k == "text":
+            ov["content"] = f"Overlay {i}"
+        else:
+            src = make_image(f"{ow}x{oh}") if k == "image" else make_clip(f"{ow}x{oh}", length / 2)
+            ov["content"], ov["width"], ov["height"] = src.name, ow, oh
+            files[src.name] = src
+        overlays.append(ov)
+    return overlays, files
+
+
+# ------------------------------
+# SERVER UNDER TEST
+# ------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: Path, port: int, cache: bool) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONUNBUFFERED="1", RENDER_ROLE="all", RENDER_CACHE="1" if cache else "0")
+    log = (workdir / "server.log").open("w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}; see {workdir / 'server.log'}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/scheduler", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not start within 30s")
+
+
+def upload(base_url: str, video: Path, overlays: List[Dict[str, Any]], files: Dict[str, Path],
+           render_mode: str = "auto"):
+    handles = [("files", (video.name, video.open("rb"), "video/mp4"))]
+    handles += [("files", (name, p.open("rb"), "application/octet-stream")) for name, p in files.items()]
+    try:
+        started = time.perf_counter()
+        r = requests.post(f"{base_url}/upload", files=handles,
+                          data={"overlays_json": json.dumps(overlays), "render_mode": render_mode}, timeout=600)
+        return r, time.perf_counter() - started
+    finally:
+        for _, (_, fh, _) in handles:
+            fh.close()
+
+
+def wait_for(base_url: str, job_id: str, timeout: float) -> Dict[str, Any]:
+    deadline = time.time() + timeout
+    while True:
+        job = requests.get(f"{base_url}/status/{job_id}", timeout=30).json()
+        if job.get("status") in FINAL_STATUSES or time.time() > deadline:
+            return job
+        time.sleep(0.25)
+
+
+# ------------------------------
+# SWEEPS
+# ------------------------------
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(pct / 100 * (len(values) - 1)))))
+    return round(values[idx], 4)
+
+
+def render_sweep(base_url: str, args) -> List[Dict[str, Any]]:
+    points = []
+    for length in args.lengths:
+        for size in args.resolutions:
+            video = make_video(length, size)
+            for count in args.overlays:
+                for kind in (args.types if count else ["none"]):
+                    overlays, files = build_overlays(kind, count, length, size) if count else ([], {})
+                    runs = []
+                    for _ in range(args.repeat):
+                        r, upload_s = upload(base_url, video, overlays, files, args.render_mode)
+                        if r.status_code != 200:
+                            runs.append({"upload_seconds": round(upload_s, 4), "status": "upload_failed",
+                                         "http_status": r.status_code, "error": r.text[:500]})
+                            continue
+                        started = time.perf_counter()
+                        job = wait_for(base_url, r.json()["job_id"], args.timeout)
+                        runs.append({
+                            "upload_seconds": round(upload_s, 4),
+                            "wall_seconds": round(time.perf_counter() - started + upload_s, 4),
+                            "status": job.get("status"),
+                            **{k: job.get(k) for k in JOB_FIELDS if job.get(k) is not None},
+                        })
+                    walls = [run["wall_seconds"] for run in runs if run["status"] == "done"]
+                    point = {
+                        "length": length, "resolution": size, "overlays": count, "type": kind,
+                        "render_mode": args.render_mode,
+                        "wall_seconds_median": percentile(walls, 50),
+                        "realtime_factor_median": percentile(
+                            [run["realtime_factor"] for run in runs if run.get("realtime_factor")], 50),
+                        "failed": sum(1 for run in runs if run["status"] != "done"),
+                        "runs": runs,
+                    }
+                    print(f"render {size} {length:g}s {count}x{kind}: "
+                          f"{point['wall_seconds_median']}s wall, {point['realtime_factor_median']}x realtime")
+                    points.append(point)
+    return points
+
+
+def api_sweep(base_url: str, args) -> List[Dict[str, Any]]:
+    video = make_video(args.api_length, args.api_resolution)
+    points = []
+    for concurrency in args.concurrency:
+        def one(_):
+            """
+            (upload seconds, status seconds, error or None) for one client
+            request; failures are recorded, never raised.
+            """
+            overlays = [{"id": "t", "type": "text", "content": uuid.uuid4().hex[:8],
+                         "x": 10, "y": 10, "start_time": 0, "end_time": 1}]
+            try:
+                r, upload_s = upload(base_url, video, overlays, {}, "auto")
+                if r.status_code != 200:
+                    return upload_s, None, f"upload HTTP {r.status_code}"
+                started = time.perf_counter()
+                s = requests.get(f"{base_url}/status/{r.json()['job_id']}", timeout=30)
+                status_s = time.perf_counter() - started
+                if s.status_code != 200:
+                    return upload_s, status_s, f"status HTTP {s.status_code}"
+                return upload_s, status_s, None
+            except Exception as e:
+                return None, None, type(e).__name__
+
+        total = concurrency * args.requests_per_client
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - started
+        uploads = [u for u, _, err in results if err is None]
+        statuses = [s for _, s, err in results if err is None]
+        errors: Dict[str, int] = {}
+        for _, _, err in results:
+            if err is not None:
+                errors[err] = errors.get(err, 0) + 1
+        point = {
+            "concurrency": concurrency,
+            "requests": total,
+            "errors": sum(errors.values()),
+            "error_kinds": errors,
+            "uploads_per_second": round(len(uploads) / elapsed, 3) if elapsed else None,
+            "upload_p50": percentile(uploads, 50),
+            "upload_p95": percentile(uploads, 95),
+            "upload_max": percentile(uploads, 100),
+            "status_p50": percentile(statuses, 50),
+            "status_p95": percentile(statuses, 95),
+        }
+        print(f"api concurrency {concurrency}: upload p95 {point['upload_p95']}s, "
+              f"status p95 {point['status_p95']}s, {point['errors']} errors")
+        points.append(point)
+    return points
+
+
+def environment() -> Dict[str, Any]:
+    def first_line(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, cwd=BACKEND_DIR).stdout.splitlines()[0]
+        except Exception:
+            return None
+
+    return {
+        "commit": first_line(["git", "rev-parse", "HEAD"]),
+        "ffmpeg": first_line(["ffmpeg", "-version"]),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "render_workers": os.environ.get("RENDER_WORKERS"),
+        "ffmpeg_threads": os.environ.get("FFMPEG_THREADS"),
+    }
+
+
+def run(args) -> int:
+    INPUTS_DIR.mkdir(exist_ok=True)
+    workdir = RUNS_DIR / time.strftime("%Y%m%d-%H%M%S")
+    workdir.mkdir(parents=True)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    report: Dict[str, Any] = {
+        "started_at": time.time(),
+        "environment": environment(),
+        "args": {k: v for k, v in vars(args).items() if k != "func"},
+    }
+    server = start_server(workdir, port, args.cache)
+    try:
+        if not args.skip_render:
+            report["render"] = render_sweep(base_url, args)
+        if not args.skip_api:
+            report["api"] = api_sweep(base_url, args)
+        report["metrics"] = requests.get(f"{base_url}/metrics", timeout=30).text
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report["finished_at"] = time.time()
+    Path(args.out).write_text(json.dumps(report, indent=2))
+    print(f"report written to {args.out}")
+    return 0
+
+
+# ------------------------------
+# COMPARE
+# ------------------------------
+
+def compare(args) -> int:
+    """
+    Flag render points whose median wall time rose, or realtime factor
+    fell, by more than threshold, and API points whose p95 upload latency
+    rose by more than threshold.
+    """
+    old = json.loads(Path(args.baseline).read_text())
+    new = json.loads(Path(args.report).read_text())
+    regressions = []
+
+    def check(label: str, before, after, higher_is_better: bool):
+        if not before or after is None:
+            return
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        flag = "REGRESSION" if worse > args.threshold else "ok"
+        print(f"{flag:10} {label}: {before} -> {after} ({change:+.1%})")
+        if worse > args.threshold:
+            regressions.append(label)
+
+    def render_key(p):
+        return (p["length"], p["resolution"], p["overlays"], p["type"], p.get("render_mode"))
+
+    old_render = {render_key(p): p for p in old.get("render", [])}
+    for p in new.get("render", []):
+        before = old_render.get(render_key(p))
+        if before is None:
+            continue
+        label = f"render {p['resolution']} {p['length']:g}s {p['overlays']}x{p['type']}"
+        check(f"{label} wall", before.get("wall_seconds_median"), p.get("wall_seconds_median"), False)
+        check(f"{label} realtime", before.get("realtime_factor_median"), p.get("realtime_factor_median"), True)
+
+    old_api = {p["concurrency"]: p for p in old.get("api", [])}
+    for p in new.get("api", []):
+        before = old_api.get(p["concurrency"])
+        if before is not None:
+            check(f"api c={p['concurrency']} upload p95", before.get("upload_p95"), p.get("upload_p95"), False)
+
+    print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def csv(kind):
+    return lambda raw: [kind(x) for x in raw.split(",") if x.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Render and API benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("run", help="run the benchmark sweeps and write a JSON report")
+    p.add_argument("--out", default="bench_report.json")
+    p.add_argument("--lengths", type=csv(float), default=[10.0, 60.0], help="base video seconds")
+    p.add_argument("--resolutions", type=csv(str), default=["640x360", "1280x720"])
+    p.add_argument("--overlays", type=csv(int), default=[0, 4, 16], help="overlay counts")
+    p.add_argument("--types", type=csv(str), default=["text", "image", "video", "mixed"])
+    p.add_argument("--render-mode", default="auto", choices=["auto", "segment", "chunked", "full"])
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--timeout", type=float, default=1800, help="seconds to wait for one render")
+    p.add_argument("--concurrency", type=csv(int), default=[1, 4, 16])
+    p.add_argument("--requests-per-client", type=int, default=4)
+    p.add_argument("--api-length", type=float, default=5.0)
+    p.add_argument("--api-resolution", default="640x360")
+    p.add_argument("--cache", action="store_true", help="keep the render cache on (off by default)")
+    p.add_argument("--skip-render", action="store_true")
+    p.add_argument("--skip-api", action="store_true")
+    p.add_argument("--keep", action="store_true", help="keep the scratch server directory")
+    p.set_defaults(func=run)
+
+    p = sub.add_parser("compare", help="compare two reports; exit 1 on regressions")
+    p.add_argument("baseline")
+    p.add_argument("report")
+    p.add_argument("--threshold", type=float, default=0.10)
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# chunked.py
+#
+# Parallel chunked encoding: split the base video into keyframe-aligned
+# chunks, render each chunk (overlay times shifted into chunk-local time)
+# as its own ffmpeg process, then join them losslessly with the concat
+# demuxer. Each ffmpeg is a separate OS process, so a small thread pool
+# that only waits on their pipes is enough to keep all cores busy.
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ffmpeg_utils import ffprobe_keyframes, concat_copy_cmd, write_concat_list
+from render import build_render_cmd, run_ffmpeg, matching_encode_args, MP4_ARGS
+from segments import shift_overlays, TS_ARGS
+
+# chunks shorter than this are not worth the extra process and concat
+CHUNK_MIN_SECONDS = float(os.environ.get("RENDER_CHUNK_MIN_SECONDS", "30"))
+# ffmpeg threads per chunk encoder; parallel chunks = thread budget / this
+CHUNK_THREADS = int(os.environ.get("RENDER_CHUNK_THREADS", "2"))
+
+
+def plan_chunks(duration: float, keyframes: List[float], n: int) -> List[Tuple[float, float]]:
+    """
+    Split [0, duration] into at most n pieces of roughly equal length, each
+    starting on a keyframe.
+    """
+    kfs = sorted(k for k in keyframes if 0 < k < duration)
+    cuts = [0.0]
+    for i in range(1, n):
+        target = duration * i / n
+        k = next((k for k in kfs if k >= target), None)
+        if k is not None and k > cuts[-1]:
+            cuts.append(k)
+    cuts.append(duration)
+    return [(cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1) if cuts[i + 1] > cuts[i]]
+
+
+def chunk_plan_for(input_video: Path, duration: float, threads: int, force: bool = False
+                   ) -> Optional[Dict[str, Any]]:
+    """
+    Returns {"chunks", "parallel", "chunk_threads"} or None when the video is
+    too short (or has no usable keyframes) to split. threads is the number
+    of ffmpeg threads the render may use (see RenderScheduler.cpu_budget).
+    """
+    budget = threads or os.cpu_count() or 1
+    parallel = max(1, budget // max(1, CHUNK_THREADS))
+    n = min(parallel, int(duration // CHUNK_MIN_SECONDS)) if duration else 0
+    if force:
+        n = max(n, 2)
+    if n < 2:
+        return None
+    keyframes = ffprobe_keyframes(input_video)
+    chunks = plan_chunks(duration, keyframes, n)
+    if len(chunks) < 2:
+        return None
+    return {
+        "chunks": chunks,
+        "parallel": min(parallel, len(chunks)),
+        "chunk_threads": max(1, budget // min(parallel, len(chunks))),
+    }
+
+
+def render_chunked(input_video: Path, overlays: List[Dict[str, Any]], jobdir: Path, out_path: Path,
+                   plan: Dict[str, Any], probe: Optional[Dict[str, Any]], logf,
+                   on_start: Callable, on_progress: Callable[..., None],
+                   is_cancelled: Callable[[], bool]) -> int:
+    """
+    Render all chunks in parallel and concat them. Chunks without overlays
+    are stream-copied when encoded chunks can match the source's stream
+    parameters; otherwise every chunk is encoded with the same settings. on_progress(pct, stats)
+    gets progress merged across chunks. Returns the first non-zero ffmpeg
+    exit code, or the concat exit code.
+    """
+    chunkdir = jobdir / "chunks"
+    shutil.rmtree(chunkdir, ignore_errors=True)
+    chunkdir.mkdir()
+
+    chunks = plan["chunks"]
+    thread_args = ["-threads", str(plan["chunk_threads"])]
+    video_args = matching_encode_args(probe)
+    copy_ok = video_args is not None
+    total = sum(end - start for start, end in chunks) or 1.0
+    done = [0.0] * len(chunks)
+    lock = threading.Lock()
+
+    def report(i: int, t_sec: float, stats=None):
+        with lock:
+            done[i] = min(t_sec, chunks[i][1] - chunks[i][0])
+            pct = min(99, int(sum(done) / total * 100))
+        on_progress(pct, stats)
+
+    def render_one(i: int) -> int:
+        if is_cancelled():
+            return -1
+        start, end = chunks[i]
+        length = end - start
+        part = chunkdir / f"chunk_{i:04d}.ts"
+        cmd = build_render_cmd(
+            input_video, shift_overlays(overlays, start, length), jobdir, part,
+            thread_args=thread_args, seek=(start, length), out_args=TS_ARGS, encode=not copy_ok, probe=probe,
+            video_args=video_args,
+        )
+        with (chunkdir / f"chunk_{i:04d}.log").open("w", encoding="utf-8") as clog:
+            rc = run_ffmpeg(cmd, clog, on_stats=lambda st: report(i, st.get("out_time") or 0.0, st), on_start=on_start)
+        if rc == 0:
+            report(i, length)
+        return rc
+
+    logf.write(
+        f"Chunked render: {len(chunks)} chunks, {plan['parallel']} in parallel, "
+        f"{plan['chunk_threads']} threads each; per-chunk logs in {chunkdir}\n"
+    )
+    for i, (start, end) in enumerate(chunks):
+        logf.write(f"  chunk {i}: {start:.3f}-{end:.3f}\n")
+    logf.flush()
+
+    with ThreadPoolExecutor(max_workers=plan["parallel"], thread_name_prefix="chunk") as pool:
+        results = list(pool.map(render_one, range(len(chunks))))
+
+    logf.write(f"chunk exit codes: {results}\n\n")
+    failed = next((rc for rc in results if rc != 0), None)
+    if failed is not None:
+        return failed
+    if is_cancelled():
+        return -1
+
+    list_file = chunkdir / "concat.txt"
+    write_concat_list(list_file, [chunkdir / f"chunk_{i:04d}.ts" for i in range(len(chunks))])
+    rc = run_ffmpeg(concat_copy_cmd(list_file, out_path, MP4_ARGS), logf, on_start=on_start)
+    if rc == 0:
+        shutil.rmtree(chunkdir, ignore_errors=True)
+    return rc
@@ -0,0 +1,126 @@
+# delivery.py
+#
+# Serving rendered files: ETag / Last-Modified validators, conditional GET
+# (304) and single byte ranges (206), so players can seek, interrupted
+# downloads can resume and unchanged files are not downloaded twice.
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import aiofiles
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+READ_CHUNK = 256 * 1024
+
+
+def etag_for(path: Path) -> str:
+    st = path.stat()
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def content_disposition(filename: str) -> str:
+    """
+    attachment header for any filename: a plain quoted name when it is safe
+    ASCII, otherwise an ASCII fallback plus the RFC 5987 filename*.
+    """
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'attachment; filename="{filename}"'
+    fallback = "".join(c if 32 <= ord(c) < 127 and c not in '"\\' else "_" for c in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=utf-8''{quoted}"
+
+
+def _matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive for a single "bytes=" range, or None when the
+    header is absent, malformed or asks for several ranges (the whole file
+    is sent then). Raises ValueError if the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    if not sep or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+    if first == "":
+        if not last:
+            return None
+        if int(last) == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if start >= size:
+        raise ValueError("range starts past the end")
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+async def _read(path: Path, start: int, length: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(READ_CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request: Request, path: Path, media_type: str, filename: Optional[str] = None,
+               cache_control: str = "no-cache") -> Response:
+    """
+    Response for path honouring If-None-Match / If-Modified-Since, Range and
+    If-Range. cache_control "no-cache" makes clients revalidate (cheap with
+    the ETag); files that never change can pass "public, max-age=...".
+    """
+    st = path.stat()
+    etag = etag_for(path)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control,
+    }
+    if filename:
+        headers["Content-Disposition"] = content_disposition(filename)
+
+    inm = request.headers.get("if-none-match")
+    ims = request.headers.get("if-modified-since")
+    if (inm is not None and _matches(inm, etag)) or (inm is None and ims and _not_modified_since(ims, st.st_mtime)):
+        return Response(status_code=304, headers=headers)
+
+    size = st.st_size
+    rng = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rng and if_range and if_range != etag and not (
+            not if_range.startswith('"') and _not_modified_since(if_range, st.st_mtime)):
+        rng = None  # file changed since the client's copy: send all of it
+    try:
+        byte_range = parse_range(rng, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if request.method == "HEAD":
+        return Response(status_code=200, headers={**headers, "Content-Length": str(size)}, media_type=media_type)
+    if byte_range is None:
+        return StreamingResponse(_read(path, 0, size), media_type=media_type,
+                                 headers={**headers, "Content-Length": str(size)})
+    start, end = byte_range
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+    return StreamingResponse(_read(path, start, end - start + 1), status_code=206,
+                             media_type=media_type, headers=headers)
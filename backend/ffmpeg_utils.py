@@ -33,3 +33,149 @@ def ffprobe_duration(path):
         return float(out)
     except Exception:
         return None
+
+
+def ffprobe_info(path):
+    """
+    Return basic stream/format info as a dict using ffprobe JSON output;
+    returns None on failure. Keys: duration, width, height, codec, profile,
+    level, pix_fmt, fps (average), frame_rate (nominal, as "num/den"),
+    bit_rate, has_audio.
+    """
+    import json
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration,bit_rate:stream=codec_type,codec_name,profile,level,width,height,pix_fmt,avg_frame_rate,r_frame_rate",
+        "-of", "json", str(path),
+    ]
+    try:
+        p = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        data = json.loads(p.stdout or "{}")
+    except Exception:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    fmt = data.get("format") or {}
+    streams = data.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+
+    def _num(v, cast=float):
+        try:
+            return cast(v)
+        except (TypeError, ValueError):
+            return None
+
+    fps = None
+    rate = video.get("avg_frame_rate") or ""
+    if "/" in rate:
+        n, d = rate.split("/", 1)
+        if _num(d):
+            fps = _num(n) / _num(d)
+
+    return {
+        "duration": _num(fmt.get("duration")),
+        "bit_rate": _num(fmt.get("bit_rate"), int),
+        "width": _num(video.get("width"), int),
+        "height": _num(video.get("height"), int),
+        "codec": video.get("codec_name"),
+        "profile": video.get("profile"),
+        "level": _num(video.get("level"), int),
+        "pix_fmt": video.get("pix_fmt"),
+        "fps": fps,
+        "frame_rate": video.get("r_frame_rate"),
+        "has_audio": any(s.get("codec_type") == "audio" for s in streams),
+    }
+
+
+def ffprobe_keyframes(path):
+    """
+    Return sorted keyframe timestamps (seconds) of the first video stream,
+    read from packet flags so nothing is decoded; returns [] on failure.
+    """
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", str(path),
+    ]
+    try:
+        p = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    except Exception:
+        return []
+    times = []
+    for line in p.stdout.splitlines():
+        parts = line.strip().split(",")
+        if len(parts) >= 2 and "K" in parts[1]:
+            try:
+                times.append(float(parts[0]))
+            except ValueError:
+                pass
+    return sorted(times)
+
+
+def concat_copy_cmd(list_file, out_path, out_args=None):
+    """
+    ffmpeg command joining the files named in a concat-demuxer list
+    without re-encoding.
+    """
+    return [
+        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file),
+        "-map", "0:v", "-map", "0:a?", "-c", "copy", *(out_args or []), str(out_path),
+    ]
+
+
+def write_concat_list(list_file, parts):
+    with open(list_file, "w", encoding="utf-8") as f:
+        for part in parts:
+            escaped = str(Path(part).resolve()).replace("'", r"'\''")
+            f.write(f"file '{escaped}'\n")
+
+
+class ProgressParser:
+    """
+    Parses ffmpeg's machine-readable `-progress` output (key=value lines,
+    one block per report ending in progress=continue|end).
+    feed() returns the finished block as a dict, otherwise None.
+    """
+
+    def __init__(self):
+        self._block = {}
+
+    def feed(self, line: str):
+        line = (line or "").strip()
+        if "=" not in line:
+            return None
+        key, value = line.split("=", 1)
+        self._block[key.strip()] = value.strip()
+        if key.strip() != "progress":
+            return None
+        raw, self._block = self._block, {}
+        return self.summarize(raw)
+
+    @staticmethod
+    def summarize(raw):
+        def num(v, cast=float):
+            try:
+                return cast(v)
+            except (TypeError, ValueError):
+                return None
+
+        out_time = None
+        us = num(raw.get("out_time_us"), int)
+        if us is None:
+            us = num(raw.get("out_time_ms"), int)  # also microseconds, despite the name
+        if us is not None and us >= 0:
+            out_time = us / 1_000_000
+        elif raw.get("out_time"):
+            out_time = parse_time_from_ffmpeg_line("time=" + raw["out_time"])
+
+        bitrate = (raw.get("bitrate") or "").replace("kbits/s", "").strip()
+        speed = (raw.get("speed") or "").replace("x", "").strip()
+        return {
+            "frame": num(raw.get("frame"), int),
+            "fps": num(raw.get("fps")),
+            "out_time": out_time,
+            "bitrate_kbps": num(bitrate),
+            "total_size": num(raw.get("total_size"), int),
+            "speed": num(speed),
+            "progress": raw.get("progress"),
+        }
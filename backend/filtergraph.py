@@ -0,0 +1,245 @@
+# filtergraph.py
+#
+# Compiles the overlay list into ffmpeg inputs + a filter_complex.
+#
+#  - overlays outside the frame or outside the video duration are dropped
+#  - overlay videos are trimmed at the input (-ss/-t) to their visible
+#    window and shifted into place with setpts, so only those frames decode
+#  - images are single-frame inputs: scaled and converted to RGBA once,
+#    then held by overlay for the rest of the window
+#  - all text is drawn first, then images and videos on top in list order;
+#    consecutive images sharing the same time window are composited once
+#    into a single RGBA layer, so each output frame pays for one overlay
+#    instead of N
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# a merged layer is blended over its whole bounding box every frame; only
+# merge when that box is not much larger than the images it replaces
+MERGE_MAX_AREA_RATIO = 2.0
+
+
+class FilterGraph:
+    def __init__(self):
+        self.input_args: List[str] = []
+        self.filter_parts: List[str] = []
+        self.out_label = ""
+        self.num_inputs = 0
+        self.skipped: List[Tuple[str, str]] = []  # (overlay id, reason)
+
+    @property
+    def filter_complex(self) -> str:
+        return "; ".join(self.filter_parts)
+
+
+def _num(v, default):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def _fmt(v: float) -> str:
+    return f"{v:.6f}".rstrip("0").rstrip(".")
+
+
+def window(ov: Dict[str, Any]) -> Tuple[float, float]:
+    return _num(ov.get("start_time"), 0), _num(ov.get("end_time"), 5)
+
+
+def escape_text(txt: str) -> str:
+    return (txt or "").replace("'", r"'\''").replace(":", r"\:")
+
+
+def _size(ov: Dict[str, Any]) -> Tuple[int, int]:
+    return int(_num(ov.get("width"), -1)), int(_num(ov.get("height"), -1))
+
+
+def skip_reason(ov: Dict[str, Any], duration: Optional[float], frame: Optional[Tuple[int, int]]) -> Optional[str]:
+    """
+    Why an overlay can never be visible, or None if it may be.
+    """
+    start, end = window(ov)
+    if end <= start or end <= 0:
+        return "empty time window"
+    if duration and start >= duration:
+        return "starts after end of video"
+    if frame and frame[0] and frame[1]:
+        default = 50 if ov.get("type") == "text" else 0
+        x, y = _num(ov.get("x"), default), _num(ov.get("y"), default)
+        if x >= frame[0] or y >= frame[1]:
+            return "outside frame"
+        w, h = _size(ov)
+        if (w > 0 and x + w <= 0) or (h > 0 and y + h <= 0):
+            return "outside frame"
+    return None
+
+
+def compile_overlays(overlays: List[Dict[str, Any]], jobdir: Path, duration: Optional[float] = None,
+                     frame: Optional[Tuple[int, int]] = None, input_seek: float = 0.0,
+                     base_label: str = "[0:v]", input_offset: int = 1, prefix: str = "") -> FilterGraph:
+    """
+    Build the overlay chain on top of base_label.
+
+    duration/frame (w, h) enable culling; input_seek is where the base video
+    was seeked to (segment/chunk renders), so overlay videos stay in step.
+    input_offset is the ffmpeg index of the first overlay input and prefix
+    keeps labels unique when several graphs share one filter_complex.
+    """
+    g = FilterGraph()
+    label = base_label
+    n = 0
+
+    def new_label(kind: str) -> str:
+        nonlocal n
+        n += 1
+        return f"[{prefix}{kind}{n}]"
+
+    def add_input(args: List[str]) -> int:
+        g.input_args += args
+        g.num_inputs += 1
+        return input_offset + g.num_inputs - 1
+
+    visible = []
+    for ov in overlays:
+        kind = ov.get("type")
+        if kind not in ("text", "image", "video"):
+            continue
+        reason = skip_reason(ov, duration, frame)
+        if reason is None and kind in ("image", "video"):
+            if not ov.get("content") or not (jobdir / ov["content"]).exists():
+                reason = "file missing"
+        if reason is not None:
+            g.skipped.append((str(ov.get("id", "")), reason))
+            continue
+        visible.append(ov)
+
+    # Texts first, then images and videos in list order (later ones on top).
+    # A run of consecutive sized images sharing a time window may become
+    # one layer.
+    texts = [ov for ov in visible if ov.get("type") == "text"]
+    media = [ov for ov in visible if ov.get("type") != "text"]
+    for run in _runs(texts + media):
+        kind = run[0].get("type")
+        start, end = window(run[0])
+
+        if kind == "text":
+            ov = run[0]
+            out = new_label("txt")
+            g.filter_parts.append(
+                f"{label}"
+                f"drawtext=text='{escape_text(ov.get('content'))}':"
+                f"x={ov.get('x', 50)}:y={ov.get('y', 50)}:"
+                f"fontsize={ov.get('fontsize', 24)}:fontcolor={ov.get('fontcolor', 'white')}:"
+                f"box=1:boxcolor=black@0.5:boxborderw=10:"
+                f"enable='between(t,{_fmt(start)},{_fmt(end)})'"
+                f"{out}"
+            )
+            label = out
+
+        elif kind == "image":
+            parts = []
+            if len(run) > 1 and _worth_merging(run):
+                layer, lx, ly = _image_layer(g, run, jobdir, add_input, new_label)
+                parts.append((layer, (lx, ly)))
+            else:
+                for ov in run:
+                    idx = add_input(["-i", str(jobdir / ov["content"])])
+                    w, h = _size(ov)
+                    scaled = new_label("img")
+                    g.filter_parts.append(f"[{idx}:v]scale={w}:{h},format=rgba{scaled}")
+                    parts.append((scaled, (_num(ov.get("x"), 0), _num(ov.get("y"), 0))))
+
+            for src, (x, y) in parts:
+                out = new_label("ov")
+                g.filter_parts.append(
+                    f"{label}{src}overlay={_fmt(x)}:{_fmt(y)}:"
+                    f"enable='between(t,{_fmt(start)},{_fmt(end)})'"
+                    f"{out}"
+                )
+                label = out
+
+        else:
+            # videos are decoded only for their visible window
+            ov = run[0]
+            if duration:
+                end = min(end, duration)
+            vis_start = max(0.0, start)
+            # the overlay clip runs on the base timeline, so at base time T it shows
+            # its own position T (+ input_seek for seeked segment renders)
+            idx = add_input([
+                "-ss", _fmt(input_seek + vis_start), "-t", _fmt(end - vis_start),
+                "-i", str(jobdir / ov["content"]),
+            ])
+            w, h = _size(ov)
+            clip = new_label("vid")
+            g.filter_parts.append(f"[{idx}:v]scale={w}:{h},setpts=PTS-STARTPTS+{_fmt(vis_start)}/TB{clip}")
+            out = new_label("ov")
+            g.filter_parts.append(
+                f"{label}{clip}overlay={ov.get('x', 0)}:{ov.get('y', 0)}:"
+                f"enable='between(t,{_fmt(start)},{_fmt(end)})'"
+                f"{out}"
+            )
+            label = out
+
+    g.out_label = label
+    return g
+
+
+def _mergeable(ov: Dict[str, Any]) -> bool:
+    return ov.get("type") == "image" and all(v > 0 for v in _size(ov))
+
+
+def _runs(overlays: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Split overlays into draw steps, keeping their order: consecutive sized
+    images with the same time window form one run, everything else is a
+    run of one.
+    """
+    runs: List[List[Dict[str, Any]]] = []
+    for ov in overlays:
+        prev = runs[-1][-1] if runs else None
+        if prev is not None and _mergeable(ov) and _mergeable(prev) and window(ov) == window(prev):
+            runs[-1].append(ov)
+        else:
+            runs.append([ov])
+    return runs
+
+
+def _bbox(members: List[Dict[str, Any]]) -> Tuple[float, float, int, int]:
+    xs = [_num(ov.get("x"), 0) for ov in members]
+    ys = [_num(ov.get("y"), 0) for ov in members]
+    sizes = [_size(ov) for ov in members]
+    bx, by = min(xs), min(ys)
+    bw = int(max(x + s[0] for x, s in zip(xs, sizes)) - bx)
+    bh = int(max(y + s[1] for y, s in zip(ys, sizes)) - by)
+    return bx, by, bw, bh
+
+
+def _worth_merging(members: List[Dict[str, Any]]) -> bool:
+    _, _, bw, bh = _bbox(members)
+    area = sum(w * h for w, h in (_size(ov) for ov in members))
+    return bw * bh <= area * MERGE_MAX_AREA_RATIO
+
+
+def _image_layer(g: FilterGraph, members: List[Dict[str, Any]], jobdir: Path, add_input, new_label):
+    """
+    Composite several sized images onto one transparent canvas covering
+    their bounding box. Everything here runs on a single frame.
+    Returns (layer label, x, y).
+    """
+    bx, by, bw, bh = _bbox(members)
+
+    canvas = new_label("canvas")
+    g.filter_parts.append(f"color=c=black@0.0:s={bw}x{bh}:r=1:d=1,format=rgba{canvas}")
+    layer = canvas
+    for ov in members:
+        x, y = _num(ov.get("x"), 0), _num(ov.get("y"), 0)
+        w, h = _size(ov)
+        idx = add_input(["-i", str(jobdir / ov["content"])])
+        scaled = new_label("img")
+        g.filter_parts.append(f"[{idx}:v]scale={w}:{h},format=rgba{scaled}")
+        out = new_label("layer")
+        g.filter_parts.append(f"{layer}{scaled}overlay={_fmt(x - bx)}:{_fmt(y - by)}:format=rgb{out}")
+        layer = out
+    return layer, bx, by
@@ -0,0 +1,277 @@
+# job_queue.py
+import os
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from job_store import thread_connection
+
+# a job whose worker has not heartbeated for this long is handed to another worker
+LEASE_SECONDS = float(os.environ.get("RENDER_LEASE_SECONDS", "30"))
+# claims per job before it is given up on (a job that crashes its worker every time)
+MAX_ATTEMPTS = int(os.environ.get("RENDER_MAX_ATTEMPTS", "3"))
+
+
+class JobQueue(ABC):
+    """
+    Render queue shared by every process that serves the API or renders.
+    Jobs are claimed under a lease: the claiming worker renews it with
+    heartbeat() while it renders and releases it when done. A job whose
+    lease runs out (crashed or hung worker) becomes claimable again.
+    Higher priority is claimed first; equal priorities in FIFO order.
+    """
+
+    @abstractmethod
+    def enqueue(self, job_id: str, priority: int = 0, queued_at: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    def claim(self, worker: str, lease: float = LEASE_SECONDS,
+              host_limit: Optional[int] = None) -> Tuple[Optional[str], List[Tuple[str, bool]]]:
+        """
+        Returns (job_id or None, dead) where dead lists (job_id, cancelled)
+        for jobs dropped from the queue because their worker went away after
+        MAX_ATTEMPTS claims or after a cancel was requested.
+        worker ids start with "<host>:"; with host_limit nothing is claimed
+        while that many render slots are held under live leases on the same
+        host (see host_leases).
+        """
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker: str, lease: float = LEASE_SECONDS) -> str:
+        """
+        Renew a lease. Returns "ok", "cancel" (cancel requested elsewhere) or
+        "lost" (the lease expired and the job is no longer ours).
+        """
+
+    @abstractmethod
+    def release(self, job_id: str, worker: str):
+        ...
+
+    @abstractmethod
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """
+        "dequeued" if the job was waiting (it is removed), "signalled" if a
+        worker holds it (it will stop at its next heartbeat), else None.
+        """
+
+    @abstractmethod
+    def position(self, job_id: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def host_leases(self, worker: str) -> int:
+        """
+        Render slots held under live leases by workers on the same host as
+        worker (one per job plus any borrowed with reserve_slots).
+        """
+
+    @abstractmethod
+    def reserve_slots(self, job_id: str, worker: str, extra: int, host_limit: int) -> int:
+        """
+        Let a leased job hold up to extra more render slots of its host,
+        as far as they are free under host_limit; claims count them until
+        the job is released. extra=0 gives borrowed slots back. Returns the
+        number of extra slots granted.
+        """
+
+    def check_host(self, host: str):
+        """
+        Raise RuntimeError if this queue cannot be used from host (e.g. a
+        single-host queue already in use elsewhere).
+        """
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Queue table in a local SQLite file. Claims run in BEGIN IMMEDIATE
+    transactions, so any number of processes on one host can claim from
+    it. It must not be shared between hosts: WAL mode needs shared memory
+    on one machine and network filesystem locks are unreliable, so a lease
+    could be granted twice.
+    """
+
+    def __init__(self, path: Path, max_attempts: int = MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS job_queue (
+                job_id TEXT PRIMARY KEY,
+                priority INTEGER NOT NULL DEFAULT 0,
+                queued_at REAL NOT NULL,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                slots INTEGER NOT NULL DEFAULT 1,
+                cancel INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS job_queue_order_idx ON job_queue (priority DESC, queued_at);
+            """
+        )
+        # queue tables created before slots were tracked
+        columns = [row[1] for row in self._conn().execute("PRAGMA table_info(job_queue)")]
+        if "slots" not in columns:
+            self._conn().execute("ALTER TABLE job_queue ADD COLUMN slots INTEGER NOT NULL DEFAULT 1")
+
+    def _conn(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    def enqueue(self, job_id: str, priority: int = 0, queued_at: Optional[float] = None):
+        self._conn().execute(
+            "INSERT OR IGNORE INTO job_queue (job_id, priority, queued_at) VALUES (?, ?, ?)",
+            (job_id, int(priority), queued_at or time.time()),
+        )
+
+    def claim(self, worker: str, lease: float = LEASE_SECONDS,
+              host_limit: Optional[int] = None) -> Tuple[Optional[str], List[Tuple[str, bool]]]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dead = conn.execute(
+                "SELECT job_id, cancel FROM job_queue WHERE worker IS NOT NULL AND lease_until < ? "
+                "AND (cancel = 1 OR attempts >= ?)",
+                (now, self.max_attempts),
+            ).fetchall()
+            for job_id, _ in dead:
+                conn.execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+            row = None
+            if host_limit is None or self._count_host_leases(conn, worker, now) < host_limit:
+                row = conn.execute(
+                    "SELECT job_id FROM job_queue WHERE (worker IS NULL OR lease_until < ?) AND cancel = 0 "
+                    "ORDER BY priority DESC, queued_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job_queue SET worker = ?, lease_until = ?, attempts = attempts + 1, slots = 1 "
+                    "WHERE job_id = ?",
+                    (worker, now + lease, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return (row[0] if row else None), [(job_id, bool(cancel)) for job_id, cancel in dead]
+
+    def host_leases(self, worker: str) -> int:
+        return self._count_host_leases(self._conn(), worker, time.time())
+
+    def reserve_slots(self, job_id: str, worker: str, extra: int, host_limit: int) -> int:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT slots FROM job_queue WHERE job_id = ? AND worker = ?", (job_id, worker)
+            ).fetchone()
+            granted = 0
+            if row is not None:
+                free = host_limit - (self._count_host_leases(conn, worker, now) - row[0] + 1)
+                granted = max(0, min(extra, free))
+                conn.execute("UPDATE job_queue SET slots = ? WHERE job_id = ? AND worker = ?",
+                             (1 + granted, job_id, worker))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return granted
+
+    @staticmethod
+    def _count_host_leases(conn: sqlite3.Connection, worker: str, now: float) -> int:
+        prefix = worker.split(":", 1)[0] + ":"
+        return conn.execute(
+            "SELECT COALESCE(SUM(slots), 0) FROM job_queue WHERE substr(worker, 1, ?) = ? AND lease_until >= ?",
+            (len(prefix), prefix, now),
+        ).fetchone()[0]
+
+    def heartbeat(self, job_id: str, worker: str, lease: float = LEASE_SECONDS) -> str:
+        conn = self._conn()
+        cur = conn.execute(
+            "UPDATE job_queue SET lease_until = ? WHERE job_id = ? AND worker = ?",
+            (time.time() + lease, job_id, worker),
+        )
+        if cur.rowcount == 0:
+            return "lost"
+        row = conn.execute("SELECT cancel FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+        return "cancel" if row and row[0] else "ok"
+
+    def release(self, job_id: str, worker: str):
+        self._conn().execute("DELETE FROM job_queue WHERE job_id = ? AND worker = ?", (job_id, worker))
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT worker, lease_until FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                action = None
+            elif row[0] is None or row[1] < time.time():
+                conn.execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+                action = "dequeued"
+            else:
+                conn.execute("UPDATE job_queue SET cancel = 1 WHERE job_id = ?", (job_id,))
+                action = "signalled"
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return action
+
+    def position(self, job_id: str) -> Dict[str, Any]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT priority, queued_at, worker, lease_until FROM job_queue WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return {}
+        priority, queued_at, worker, lease_until = row
+        now = time.time()
+        if worker is not None and lease_until >= now:
+            return {"queue_position": 0, "worker": worker}
+        waiting = "(worker IS NULL OR lease_until < ?)"
+        ahead = conn.execute(
+            f"SELECT COUNT(*) FROM job_queue WHERE {waiting} AND (priority > ? OR (priority = ? AND queued_at < ?))",
+            (now, priority, priority, queued_at),
+        ).fetchone()[0]
+        length = conn.execute(f"SELECT COUNT(*) FROM job_queue WHERE {waiting}", (now,)).fetchone()[0]
+        return {
+            "queue_position": ahead + 1,
+            "queue_length": length,
+            "wait_seconds": round(now - queued_at, 3),
+        }
+
+    def counts(self) -> Dict[str, int]:
+        now = time.time()
+        queued, leased = self._conn().execute(
+            "SELECT COALESCE(SUM(worker IS NULL OR lease_until < ?), 0), "
+            "COALESCE(SUM(worker IS NOT NULL AND lease_until >= ?), 0) FROM job_queue",
+            (now, now),
+        ).fetchone()
+        return {"queued": queued, "running": leased}
+
+    def check_host(self, host: str):
+        rows = self._conn().execute(
+            "SELECT DISTINCT worker FROM job_queue WHERE worker IS NOT NULL AND lease_until >= ?",
+            (time.time(),),
+        ).fetchall()
+        others = sorted({w.split(":", 1)[0] for (w,) in rows} - {host})
+        if others:
+            raise RuntimeError(f"job queue {self.path} is leased by workers on {', '.join(others)}; "
+                               "the SQLite queue only supports workers on one host")
+
+
+def open_job_queue() -> JobQueue:
+    """
+    JOB_QUEUE_DB (default: the JOBS_DB file) holds the queue table.
+    """
+    return SqliteJobQueue(Path(os.environ.get("JOB_QUEUE_DB") or os.environ.get("JOBS_DB", "jobs.db")))
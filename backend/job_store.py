@@ -0,0 +1,237 @@
+# job_store.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+from progress import TERMINAL_STATUSES
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process guard
+    fcntl = None
+
+# progress updates arrive once per ffmpeg stderr line; persist at most this often
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", "1.0"))
+
+
+def thread_connection(local: threading.local, path: Path, synchronous: Optional[str] = None) -> sqlite3.Connection:
+    """
+    This thread's connection to the SQLite file at path, kept on local.
+    Autocommit (callers issue BEGIN IMMEDIATE themselves), WAL so readers
+    don't block the writer, and a 30s wait when another process holds the
+    write lock.
+    """
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        if synchronous:
+            conn.execute(f"PRAGMA synchronous={synchronous}")
+        local.conn = conn
+    return conn
+
+
+class JobStore(ABC):
+    """
+    Durable job state. Writes are per job; callers pass coalesce=True for
+    high-frequency progress updates, which are persisted at most once per
+    PROGRESS_FLUSH_INTERVAL seconds (the next non-coalesced save flushes them).
+    """
+
+    def __init__(self, flush_interval: float = PROGRESS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._last_write: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job_id: str, job: Dict[str, Any], coalesce: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            if coalesce and now - self._last_write.get(job_id, 0.0) < self.flush_interval:
+                return
+            if job.get("status") in TERMINAL_STATUSES:
+                self._last_write.pop(job_id, None)  # no more progress coming
+            else:
+                self._last_write[job_id] = now
+        try:
+            self._write(job_id, dict(job))
+        except Exception as e:
+            print("job store save error", job_id, e)
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def ids_by_status(self, statuses: Iterable[str]) -> List[str]:
+        ...
+
+    @abstractmethod
+    def list(self, status: Optional[str] = None, offset: int = 0, limit: int = 50) -> Tuple[List[Dict[str, Any]], int]:
+        ...
+
+    @abstractmethod
+    def _write(self, job_id: str, job: Dict[str, Any]):
+        ...
+
+
+class SqliteJobStore(JobStore):
+    """
+    One row per job, JSON payload plus indexed status/queued_at columns.
+    WAL mode lets /status readers run while render threads write.
+    """
+
+    def __init__(self, path: Path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT,
+                queued_at REAL,
+                updated_at REAL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, queued_at);
+            CREATE INDEX IF NOT EXISTS jobs_queued_idx ON jobs (queued_at);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path, synchronous="NORMAL")
+
+    def _write(self, job_id: str, job: Dict[str, Any]):
+        status = job.get("status")
+        self._conn().execute(
+            "INSERT INTO jobs (job_id, status, queued_at, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET status=excluded.status, queued_at=excluded.queued_at, "
+            "updated_at=excluded.updated_at, data=excluded.data",
+            (job_id, status if isinstance(status, str) else None, job.get("queued_at"), time.time(), json.dumps(job)),
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def ids_by_status(self, statuses: Iterable[str]) -> List[str]:
+        statuses = list(statuses)
+        marks = ",".join("?" * len(statuses))
+        rows = self._conn().execute(
+            f"SELECT job_id FROM jobs WHERE status IN ({marks}) ORDER BY queued_at", statuses
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def list(self, status: Optional[str] = None, offset: int = 0, limit: int = 50) -> Tuple[List[Dict[str, Any]], int]:
+        conn = self._conn()
+        if status:
+            total = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+            rows = conn.execute(
+                "SELECT job_id, data FROM jobs WHERE status = ? ORDER BY queued_at DESC LIMIT ? OFFSET ?",
+                (status, limit, offset),
+            ).fetchall()
+        else:
+            total = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            rows = conn.execute(
+                "SELECT job_id, data FROM jobs ORDER BY queued_at DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [{"job_id": r[0], **json.loads(r[1])} for r in rows], total
+
+    def is_empty(self) -> bool:
+        return self._conn().execute("SELECT 1 FROM jobs LIMIT 1").fetchone() is None
+
+    def import_json(self, path: Path):
+        """
+        One-time migration from the old whole-dict jobs.json file.
+        """
+        with path.open("r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        for job_id, job in legacy.items():
+            if isinstance(job, dict):
+                self._write(job_id, job)
+        print(f"Imported {len(legacy)} jobs from {path}")
+
+
+class JsonJobStore(JobStore):
+    """
+    Legacy single-file store (JOB_STORE=json). Still rewrites the whole file,
+    but under a lock and with coalesced progress writes.
+    The data lives in this process, so only one process may use it: a
+    second one (uvicorn --workers, worker.py) fails to open it.
+    """
+
+    def __init__(self, path: Path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self._owner = self._lock_file()
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._file_lock = threading.Lock()
+        if self.path.exists():
+            try:
+                with self.path.open("r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except Exception as e:
+                print("load_jobs error", e)
+
+    def _lock_file(self):
+        if fcntl is None:
+            return None
+        f = self.path.with_suffix(".lock").open("w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            raise RuntimeError(f"{self.path} is in use by another process; JOB_STORE=json only supports "
+                               "a single process, use the default sqlite store to run several")
+        return f
+
+    def _write(self, job_id: str, job: Dict[str, Any]):
+        with self._file_lock:
+            self._data[job_id] = job
+            tmp = self.path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=2)
+            tmp.replace(self.path)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._file_lock:
+            job = self._data.get(job_id)
+            return dict(job) if isinstance(job, dict) else None
+
+    def ids_by_status(self, statuses: Iterable[str]) -> List[str]:
+        statuses = set(statuses)
+        with self._file_lock:
+            items = [(k, v) for k, v in self._data.items() if isinstance(v, dict) and v.get("status") in statuses]
+        items.sort(key=lambda kv: kv[1].get("queued_at") or 0)
+        return [k for k, _ in items]
+
+    def list(self, status: Optional[str] = None, offset: int = 0, limit: int = 50) -> Tuple[List[Dict[str, Any]], int]:
+        with self._file_lock:
+            items = [(k, v) for k, v in self._data.items() if isinstance(v, dict) and (not status or v.get("status") == status)]
+        items.sort(key=lambda kv: kv[1].get("queued_at") or 0, reverse=True)
+        return [{"job_id": k, **v} for k, v in items[offset:offset + limit]], len(items)
+
+
+def open_job_store() -> JobStore:
+    """
+    JOB_STORE=sqlite (default) or json. The sqlite store imports an existing
+    jobs.json the first time it is opened.
+    """
+    kind = os.environ.get("JOB_STORE", "sqlite").lower()
+    legacy = Path(os.environ.get("JOBS_JSON", "jobs.json"))
+    if kind == "json":
+        return JsonJobStore(legacy)
+
+    store = SqliteJobStore(Path(os.environ.get("JOBS_DB", "jobs.db")))
+    if store.is_empty() and legacy.exists():
+        try:
+            store.import_json(legacy)
+        except Exception as e:
+            print("job store import error", e)
+    return store
@@ -1,20 +1,42 @@
 # backend/main.py
+import re
 import uuid
+import asyncio
+import hashlib
 import os
 import json
-import threading
-import subprocess
-import shlex
+import shutil
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, Any, List
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
+from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, Request, Body, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-# your ffmpeg utils (must implement ffprobe_duration and parse_time_from_ffmpeg_line)
-from ffmpeg_utils import ffprobe_duration, parse_time_from_ffmpeg_line
+# ffmpeg helpers (probing) and command building/running
+from ffmpeg_utils import ffprobe_duration, ffprobe_info
+from render import build_render_cmd, build_batch_cmd, run_ffmpeg, hls_output_args, ENCODE_ARGS, MP4_ARGS
+from render_cache import RenderCache, render_key
+import segments
+import chunked
+import preview
+import delivery
+from scheduler import RenderScheduler
+from job_store import open_job_store
+from job_queue import open_job_queue
+from progress import ProgressHub, TERMINAL_STATUSES
+from metrics import open_metrics
+import uploads
+import assets
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_background()  # defined at the bottom, once the scheduler exists
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,139 +49,862 @@ app.add_middleware(
 WORKDIR = Path("jobs")
 WORKDIR.mkdir(exist_ok=True)
 
+# jobs this process is rendering right now; the store is the source of truth
+# for everything else (other API processes and workers write to it too)
 jobs: Dict[str, Dict[str, Any]] = {}
-JOBS_JSON = Path("jobs.json")
+store = open_job_store()
+
+PENDING_STATUSES = ("queued", "processing")
+# ffmpeg -progress stats copied onto the job while it renders
+PROGRESS_FIELDS = ("frame", "fps", "speed", "out_time", "bitrate_kbps")
+
+# "all": serve the API and render; "api": only enqueue; "worker": only render (worker.py)
+RENDER_ROLE = os.environ.get("RENDER_ROLE", "all")
+
+progress_hub = ProgressHub()
+
+metrics = open_metrics()
+metrics.histogram("buttercut_http_request_seconds", "API request latency by route.")
+metrics.histogram("buttercut_upload_seconds", "Time to receive and store a job's input files.")
+metrics.histogram("buttercut_job_stage_seconds", "Render job time per stage (queue_wait, probe, plan, encode, total).")
+metrics.histogram("buttercut_render_realtime_factor", "Seconds of video rendered per second of encode time.",
+                  buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64))
+metrics.histogram("buttercut_render_fps", "Average frames per second of a render.",
+                  buckets=(5, 10, 25, 50, 100, 200, 400, 800))
+metrics.histogram("buttercut_output_bitrate_kbps", "Bitrate of rendered outputs.",
+                  buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+metrics.counter("buttercut_jobs_finished", "Jobs that finished rendering, by final status and render mode.")
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.observe("buttercut_http_request_seconds", time.perf_counter() - started,
+                    method=request.method, route=route, status=response.status_code)
+    return response
+
+
+def save_job(job_id: str, coalesce: bool = False, job: Optional[Dict[str, Any]] = None):
+    if job is None:
+        job = jobs.get(job_id)
+    if job is not None:
+        progress_hub.publish(job_id, progress_event(job_id, job))
+        store.save(job_id, job, coalesce=coalesce)
+
+
+def progress_event(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    event = {"job_id": job_id, "status": job.get("status"), "progress": job.get("progress"), "msg": job.get("msg")}
+    for k in PROGRESS_FIELDS + ("eta_seconds",):
+        if job.get(k) is not None:
+            event[k] = job[k]
+    if job.get("variants"):
+        event["variants"] = [{k: v[k] for k in ("name", "status", "progress")} for v in job["variants"]]
+    return event
 
 
-def save_jobs():
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        job = store.get(job_id)
+    return job
+
+
+def recover_jobs():
+    """
+    Put pending jobs that have no queue entry (submitted before the shared
+    queue existed, or the API died between saving and enqueueing) back on
+    the queue. Jobs whose worker crashed need nothing: their lease expires
+    and another worker claims them.
+    """
+    for job_id in store.ids_by_status(PENDING_STATUSES):
+        job = store.get(job_id)
+        # another process may have finished it since the listing
+        if job is None or job.get("status") not in PENDING_STATUSES:
+            continue
+        if Path(job.get("video", "")).parent.exists():
+            scheduler.submit(job_id, job.get("priority", 0), job.get("queued_at"))
+        else:
+            print(f"Job directory missing for {job_id}, marking error")
+            job["status"] = "error"
+            job["msg"] = "job folder missing on resume"
+            save_job(job_id, job=job)
+
+
+def run_render(job_id: str, threads: int):
+    job = store.get(job_id)
+    if job is None:
+        print(f"run_render: job {job_id} not in store; skipping")
+        return
+    if job.get("status") in TERMINAL_STATUSES:
+        # re-queued after it finished (e.g. by a concurrent recover_jobs)
+        return
+    jobs[job_id] = job
     try:
-        tmp = JOBS_JSON.with_suffix(".tmp")
-        with tmp.open("w", encoding="utf-8") as f:
-            json.dump(jobs, f, indent=2)
-        tmp.replace(JOBS_JSON)
-    except Exception as e:
-        print("save_jobs error", e)
+        render_job(job_id, threads)
+    finally:
+        finish_render(job_id)
+        if scheduler.owns(job_id):
+            observe_job(job)
+        jobs.pop(job_id, None)
 
 
-def load_jobs():
-    global jobs
-    if JOBS_JSON.exists():
+def observe_job(job: Dict[str, Any]):
+    """
+    Feed a rendered job's stage timings and output stats into /metrics.
+    """
+    if job.get("status") not in TERMINAL_STATUSES:
+        return
+    mode = job.get("render_mode_used") or "none"
+    for stage, seconds in (job.get("timings") or {}).items():
+        if stage != "upload":
+            metrics.observe("buttercut_job_stage_seconds", seconds, stage=stage, mode=mode)
+    if job["status"] == "done":
+        metrics.observe("buttercut_render_realtime_factor", job.get("realtime_factor"), mode=mode)
+        metrics.observe("buttercut_render_fps", job.get("avg_fps"), mode=mode)
+        metrics.observe("buttercut_output_bitrate_kbps", job.get("output_bitrate_kbps"))
+    metrics.inc("buttercut_jobs_finished", status=job["status"], mode=mode)
+
+
+def finish_render(job_id: str):
+    """
+    Publish a finished render to the render cache (or release its in-flight
+    claim) and evict old outputs beyond the cache budget.
+    """
+    job = jobs.get(job_id) or {}
+    key = job.get("render_key")
+    if not key or not scheduler.owns(job_id):
+        return
+    if job.get("status") == "done":
         try:
-            with JOBS_JSON.open("r", encoding="utf-8") as f:
-                jobs = json.load(f)
+            render_cache.add(key, job_id, Path(job["out"]))
+            render_cache.evict(on_evict=expire_job)
         except Exception as e:
-            print("load_jobs error", e)
-
-
-def resume_jobs():
-    for job_id, meta in list(jobs.items()):
-        status = meta.get("status")
-        if status not in ("done", "error"):
-            jobdir = Path(meta.get("video", "")).parent
-            if jobdir.exists():
-                print(f"Resuming job {job_id} (status={status})")
-                t = threading.Thread(target=render_job, args=(job_id,), daemon=True)
-                t.start()
-            else:
-                print(f"Job directory missing for {job_id}, marking error")
-                meta["status"] = "error"
-                meta["msg"] = "job folder missing on resume"
-                save_jobs()
+            print("render cache error", e)
+    render_cache.finish(key, job_id)
 
 
-load_jobs()
-resume_jobs()
+def abandon_job(job_id: str, cancelled: bool):
+    """
+    A job dropped from the queue after its worker went away: it was being
+    cancelled, or it took down its worker on every attempt.
+    """
+    job = store.get(job_id)
+    if job is None or job.get("status") not in PENDING_STATUSES:
+        return
+    job["status"] = "cancelled" if cancelled else "error"
+    job["msg"] = "cancelled" if cancelled else "render worker lost repeatedly; giving up"
+    settle_variants(job)
+    save_job(job_id, job=job)
+    if job.get("render_key"):
+        render_cache.finish(job["render_key"], job_id)
 
 
-@app.post("/upload")
-async def upload(files: List[UploadFile] = File(...), overlays_json: str = Form(...)):
-    job_id = str(uuid.uuid4())
-    jobdir = WORKDIR / job_id
-    jobdir.mkdir(parents=True, exist_ok=True)
+def expire_job(job_id: str):
+    job = jobs.get(job_id) or store.get(job_id)
+    if job is None:
+        return
+    job["status"] = "expired"
+    job["msg"] = "output evicted from render cache"
+    if job.get("output") == "hls":
+        shutil.rmtree(Path(job["out"]).parent / "hls", ignore_errors=True)
+    save_job(job_id, job=job)
+
 
+render_cache = RenderCache(Path(os.environ.get("RENDER_CACHE_DB", "render_cache.db")))
+RENDER_SETTINGS = {"encode": ENCODE_ARGS}
+# RENDER_CACHE=0 renders every submission (benchmarks, debugging)
+RENDER_CACHE_ENABLED = os.environ.get("RENDER_CACHE", "1") != "0"
+
+# workers claim from the queue shared by all processes; run_render is
+# defined above, render_job further down
+scheduler = RenderScheduler(target=run_render, queue=open_job_queue(), on_dead=abandon_job)
+
+
+VIDEO_EXTS = (".mp4", ".mov", ".mkv", ".webm", ".avi")
+RENDER_MODES = ("auto", "segment", "chunked", "full")
+OUTPUT_MODES = ("mp4", "hls")
+
+
+def is_video(fname: str, ctype: str) -> bool:
+    return (ctype or "").lower().startswith("video") or fname.lower().endswith(VIDEO_EXTS)
+
+
+async def collect_inputs(jobdir: Path, files: Optional[List[UploadFile]], upload_ids: str,
+                         refs: Dict[str, str]):
+    """
+    Put a job's input files into jobdir: streamed multipart files, claimed
+    chunked uploads and asset references (already checked with
+    check_asset_refs), all linked from the asset store.
+    Returns ((saved_files, {filename: sha}, base video path), None) or
+    (None, error response).
+    """
     saved_files = []
+    job_assets: Dict[str, str] = {}
     base_video_path = None
+
+    def attach(fname: str, sha: str, ctype: str):
+        nonlocal base_video_path
+        target = assets.link_into(sha, jobdir / fname)
+        saved_files.append(str(target))
+        job_assets[fname] = sha
+        if base_video_path is None and is_video(fname, ctype):
+            base_video_path = str(target)
+
     try:
-        for up in files:
+        for up in files or []:
             fname = os.path.basename(up.filename)
-            target = jobdir / fname
-            with target.open("wb") as wf:
-                content = await up.read()
-                wf.write(content)
-            saved_files.append(str(target))
+            part = jobdir / f".{fname}.part"
+            digest = hashlib.sha256()
+            await uploads.stream_to_file(up, part, on_chunk=digest.update)
+            attach(fname, assets.ingest(part, digest.hexdigest()), up.content_type)
+
+        for upload_id in parse_id_list(upload_ids):
+            try:
+                fname, ctype, sha = uploads.claim_upload(upload_id)
+            except (KeyError, ValueError) as e:
+                return None, JSONResponse(status_code=400, content={"error": "invalid upload_id", "detail": str(e)})
+            attach(fname, sha, ctype)
 
-            ctype = (up.content_type or "").lower()
-            if base_video_path is None:
-                if ctype.startswith("video") or fname.lower().endswith((".mp4", ".mov", ".mkv", ".webm", ".avi")):
-                    base_video_path = str(target)
+        for fname, sha in refs.items():
+            attach(os.path.basename(fname), sha, "")
 
         if base_video_path is None and saved_files:
             base_video_path = saved_files[0]
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": "failed to save uploaded files", "detail": str(e)})
+        return None, JSONResponse(status_code=500, content={"error": "failed to save uploaded files", "detail": str(e)})
 
     if base_video_path is None:
-        return JSONResponse(status_code=400, content={"error": "no video file uploaded"})
+        return None, JSONResponse(status_code=400, content={"error": "no video file uploaded"})
+    return (saved_files, job_assets, base_video_path), None
 
-    try:
-        overlays = json.loads(overlays_json)
-    except Exception as e:
-        return JSONResponse(status_code=400, content={"error": "invalid overlays_json", "detail": str(e)})
+
+@app.post("/upload")
+async def upload(
+    files: List[UploadFile] = File(None),
+    overlays_json: str = Form(...),
+    priority: int = Form(0),
+    upload_ids: str = Form(""),
+    asset_refs: str = Form(""),
+    render_mode: str = Form("auto"),
+    output: str = Form("mp4"),
+):
+    """
+    files: multipart files, streamed to disk.
+    upload_ids: JSON list (or comma separated) of finalized chunked uploads
+    to attach instead of, or in addition to, files.
+    asset_refs: JSON object {filename: sha256} of assets already in the
+    store (see /assets/check); nothing is uploaded for those.
+    render_mode: "auto" (segment render when overlays cover little of the
+    video, else parallel chunks for long videos), "segment", "chunked" or
+    "full".
+    output: "mp4", or "hls" to also stream the render as it progresses
+    (playlist at /hls/{job_id}/index.m3u8).
+    """
+    started = time.time()
+    if render_mode not in RENDER_MODES:
+        return JSONResponse(status_code=400, content={"error": "invalid render_mode", "allowed": list(RENDER_MODES)})
+    if output not in OUTPUT_MODES:
+        return JSONResponse(status_code=400, content={"error": "invalid output", "allowed": list(OUTPUT_MODES)})
+    overlays, err = parse_overlays(overlays_json)
+    if err:
+        return err
+    refs, err = check_asset_refs(asset_refs)
+    if err:
+        return err
+    job_id = str(uuid.uuid4())
+    jobdir = WORKDIR / job_id
+    jobdir.mkdir(parents=True, exist_ok=True)
+
+    inputs, err = await collect_inputs(jobdir, files, upload_ids, refs)
+    if err:
+        shutil.rmtree(jobdir, ignore_errors=True)
+        return err
+    saved_files, job_assets, base_video_path = inputs
+    upload_seconds = round(time.time() - started, 3)
+    metrics.observe("buttercut_upload_seconds", upload_seconds, endpoint="upload")
+
+    # identical render already finished or in flight? hand back that job
+    base_sha = job_assets.get(Path(base_video_path).name)
+    key = None
+    if base_sha and RENDER_CACHE_ENABLED:
+        key = render_key(base_sha, overlays, job_assets, {**RENDER_SETTINGS, "output": output, "render_mode": render_mode})
+    if key:
+        existing = render_cache.lookup(key)
+        if existing is None:
+            existing = render_cache.claim(key, job_id)
+            if existing is not None and (get_job(existing) or {}).get("status") not in PENDING_STATUSES:
+                render_cache.finish(key, existing)
+                existing = render_cache.claim(key, job_id)
+        if existing is not None:
+            shutil.rmtree(jobdir, ignore_errors=True)
+            return {"job_id": existing, "assets": job_assets, "cached": True, **playlist_info(existing, output)}
 
     (jobdir / "overlays.json").write_text(json.dumps(overlays))
 
     out_path = jobdir / "rendered.mp4"
 
-    jobs[job_id] = {
+    job = {
         "status": "queued",
         "progress": 0,
         "video": str(base_video_path),
         "out": str(out_path),
         "saved_files": saved_files,
+        "assets": job_assets,
+        "render_mode": render_mode,
+        "output": output,
+        "render_key": key,
+        "priority": priority,
+        "queued_at": time.time(),
+        "timings": {"upload": upload_seconds},
+        "msg": ""
+    }
+    save_job(job_id, job=job)
+
+    scheduler.submit(job_id, priority, job["queued_at"])
+
+    return {"job_id": job_id, "assets": job_assets, "cached": False, **playlist_info(job_id, output)}
+
+
+BATCH_MAX_VARIANTS = int(os.environ.get("BATCH_MAX_VARIANTS", "8"))
+
+
+def parse_variants(variants_json: str):
+    """
+    variants_json: JSON list whose items are either an overlay list or
+    {"name": ..., "overlays": [...]}. Returns ([(name, overlays)], None)
+    or (None, error response).
+    """
+    try:
+        raw = json.loads(variants_json)
+    except Exception as e:
+        return None, JSONResponse(status_code=400, content={"error": "invalid variants_json", "detail": str(e)})
+    if not isinstance(raw, list) or not raw:
+        return None, JSONResponse(status_code=400, content={"error": "variants_json must be a non-empty list"})
+    if len(raw) > BATCH_MAX_VARIANTS:
+        return None, JSONResponse(status_code=400, content={"error": "too many variants", "max": BATCH_MAX_VARIANTS})
+
+    variants = []
+    for i, item in enumerate(raw):
+        if isinstance(item, dict):
+            name, overlays = str(item.get("name") or i), item.get("overlays") or []
+        else:
+            name, overlays = str(i), item
+        if not isinstance(overlays, list) or not all(isinstance(ov, dict) for ov in overlays):
+            return None, JSONResponse(status_code=400,
+                                      content={"error": "variant overlays must be a list of objects", "variant": name})
+        variants.append((name, overlays))
+    names = [name for name, _ in variants]
+    if len(set(names)) != len(names):
+        return None, JSONResponse(status_code=400, content={"error": "variant names must be unique"})
+    return variants, None
+
+
+@app.post("/batch")
+async def batch(
+    files: List[UploadFile] = File(None),
+    variants_json: str = Form(...),
+    priority: int = Form(0),
+    upload_ids: str = Form(""),
+    asset_refs: str = Form(""),
+):
+    """
+    One base video rendered with several overlay sets (captions per
+    language, A/B variants, ...). The video is decoded once and split into
+    one overlay chain per variant inside a single ffmpeg process.
+    files / upload_ids / asset_refs work as for /upload and must include the
+    overlay media of every variant.
+    """
+    started = time.time()
+    variants, err = parse_variants(variants_json)
+    if err:
+        return err
+    refs, err = check_asset_refs(asset_refs)
+    if err:
+        return err
+    job_id = str(uuid.uuid4())
+    jobdir = WORKDIR / job_id
+    jobdir.mkdir(parents=True, exist_ok=True)
+
+    inputs, err = await collect_inputs(jobdir, files, upload_ids, refs)
+    if err:
+        shutil.rmtree(jobdir, ignore_errors=True)
+        return err
+    saved_files, job_assets, base_video_path = inputs
+    upload_seconds = round(time.time() - started, 3)
+    metrics.observe("buttercut_upload_seconds", upload_seconds, endpoint="batch")
+
+    (jobdir / "overlays.json").write_text(json.dumps([overlays for _, overlays in variants]))
+    job_variants = [
+        {"name": name, "out": str(jobdir / f"rendered_{i}.mp4"), "status": "queued", "progress": 0}
+        for i, (name, _) in enumerate(variants)
+    ]
+
+    job = {
+        "status": "queued",
+        "progress": 0,
+        "video": str(base_video_path),
+        "out": job_variants[0]["out"],
+        "variants": job_variants,
+        "saved_files": saved_files,
+        "assets": job_assets,
+        "render_mode": "batch",
+        "render_key": None,
+        "priority": priority,
+        "queued_at": time.time(),
+        "timings": {"upload": upload_seconds},
         "msg": ""
     }
-    save_jobs()
+    save_job(job_id, job=job)
+
+    scheduler.submit(job_id, priority, job["queued_at"])
+
+    return {"job_id": job_id, "assets": job_assets, "variants": [v["name"] for v in job_variants]}
+
+
+def playlist_info(job_id: str, output: str) -> Dict[str, str]:
+    return {"playlist": f"/hls/{job_id}/index.m3u8"} if output == "hls" else {}
+
+
+def parse_id_list(raw: str) -> List[str]:
+    raw = (raw or "").strip()
+    if not raw:
+        return []
+    if raw.startswith("["):
+        return [str(x) for x in json.loads(raw)]
+    return [x.strip() for x in raw.split(",") if x.strip()]
+
+
+def parse_asset_refs(raw: str):
+    """
+    asset_refs form field: JSON object {filename: sha256}. Returns
+    (refs, None) or (None, error response).
+    """
+    try:
+        refs = json.loads(raw) if (raw or "").strip() else {}
+    except Exception as e:
+        return None, JSONResponse(status_code=400, content={"error": "invalid asset_refs", "detail": str(e)})
+    if not isinstance(refs, dict) or not all(isinstance(v, str) for v in refs.values()):
+        return None, JSONResponse(status_code=400,
+                                  content={"error": "asset_refs must be a JSON object of filename to sha256"})
+    return refs, None
+
 
-    t = threading.Thread(target=render_job, args=(job_id,), daemon=True)
-    t.start()
+def check_asset_refs(raw: str):
+    """
+    parse_asset_refs plus a check that every referenced asset is stored.
+    Done before any upload session is claimed, so a bad reference does not
+    use up the client's uploads.
+    """
+    refs, err = parse_asset_refs(raw)
+    if err:
+        return None, err
+    missing = [sha for sha in refs.values() if not assets.has(sha)]
+    if missing:
+        return None, JSONResponse(status_code=400, content={"error": "unknown asset", "sha256": missing[0]})
+    return refs, None
 
-    return {"job_id": job_id}
+
+# ------------------------------
+# CONTENT-ADDRESSED ASSETS
+# ------------------------------
+
+@app.post("/assets/check")
+def assets_check(hashes: List[str] = Body(...)):
+    """
+    Body: JSON list of sha256 hex digests. Clients skip uploading any hash
+    listed as present and pass it through asset_refs instead.
+    """
+    present = [h for h in hashes if assets.has(h)]
+    return {"present": present, "missing": [h for h in hashes if h not in present]}
+
+
+@app.get("/assets/{sha}")
+def asset_info(sha: str):
+    meta = assets.metadata(sha)
+    if meta is None:
+        return JSONResponse(status_code=404, content={"error": "not found"})
+    return meta
+
+
+# ------------------------------
+# RESUMABLE CHUNKED UPLOADS
+# ------------------------------
+
+@app.post("/uploads")
+async def upload_init(filename: str = Form(...), size: int = Form(...), content_type: str = Form("")):
+    if size < 0:
+        return JSONResponse(status_code=400, content={"error": "invalid size"})
+    return await uploads.init_upload(filename, size, content_type)
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    try:
+        return await uploads.write_chunk(upload_id, offset, request.stream())
+    except KeyError:
+        return JSONResponse(status_code=404, content={"error": "upload not found"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_state(upload_id: str):
+    state = await uploads.get_upload(upload_id)
+    if state is None:
+        return JSONResponse(status_code=404, content={"error": "upload not found"})
+    return state
+
+
+@app.post("/uploads/{upload_id}/finalize")
+async def upload_finalize(upload_id: str):
+    try:
+        return await uploads.finalize_upload(upload_id)
+    except KeyError:
+        return JSONResponse(status_code=404, content={"error": "upload not found"})
+    except ValueError as e:
+        state = await uploads.get_upload(upload_id)
+        return JSONResponse(status_code=409, content={"error": str(e), "missing": state["missing"] if state else []})
+
+
+# ------------------------------
+# PREVIEWS (outside the render queue)
+# ------------------------------
+
+def preview_inputs(job_id: str, video_sha: str, asset_refs: str):
+    """
+    Resolve (base video, base hash, {filename: sha}, folder with overlay
+    files, probe) from either an existing job or asset hashes.
+    Returns (inputs, None) or (None, error response).
+    """
+    if job_id:
+        job = get_job(job_id)
+        if not job:
+            return None, JSONResponse(status_code=404, content={"error": "not found"})
+        base = Path(job["video"])
+        if not base.exists():
+            return None, JSONResponse(status_code=400, content={"error": "input video missing"})
+        job_assets = job.get("assets") or {}
+        # jobs from before the asset store have no hashes; key on the job instead
+        base_sha = job_assets.get(base.name) or f"job:{job_id}"
+        return (base, base_sha, job_assets, base.parent, asset_probe(job, base)), None
+
+    if not assets.has(video_sha):
+        return None, JSONResponse(status_code=400, content={"error": "unknown asset", "sha256": video_sha})
+    refs, err = check_asset_refs(asset_refs)
+    if err:
+        return None, err
+    workdir = preview.workdir_for(refs, assets.link_into)
+    probe = (assets.metadata(video_sha) or {}).get("probe")
+    return (assets.asset_path(video_sha), video_sha, refs, workdir, probe), None
+
+
+def parse_overlays(overlays_json: str):
+    try:
+        overlays = json.loads(overlays_json)
+    except Exception as e:
+        return None, JSONResponse(status_code=400, content={"error": "invalid overlays_json", "detail": str(e)})
+    if not isinstance(overlays, list) or not all(isinstance(ov, dict) for ov in overlays):
+        return None, JSONResponse(status_code=400, content={"error": "overlays_json must be a list of objects"})
+    return overlays, None
+
+
+@app.post("/preview/frame")
+async def preview_frame(
+    overlays_json: str = Form(...),
+    t: float = Form(0.0),
+    job_id: str = Form(""),
+    video_sha: str = Form(""),
+    asset_refs: str = Form(""),
+):
+    """
+    One composited JPEG frame at time t. Identify the base video with
+    job_id, or with video_sha plus asset_refs ({filename: sha256}) for the
+    overlay files.
+    """
+    overlays, err = parse_overlays(overlays_json)
+    if err:
+        return err
+    inputs, err = await asyncio.to_thread(preview_inputs, job_id, video_sha, asset_refs)
+    if err:
+        return err
+    base, base_sha, job_assets, workdir, probe = inputs
+    out, cached, error = await preview.frame(base, base_sha, overlays, job_assets, workdir, t, probe)
+    if error:
+        return JSONResponse(status_code=500, content={"error": "preview failed", "detail": error})
+    return FileResponse(out, media_type="image/jpeg", headers={"X-Preview-Cache": "hit" if cached else "miss"})
+
+
+@app.post("/preview/proxy")
+async def preview_proxy(
+    overlays_json: str = Form(...),
+    start: float = Form(0.0),
+    end: float = Form(...),
+    height: int = Form(360),
+    job_id: str = Form(""),
+    video_sha: str = Form(""),
+    asset_refs: str = Form(""),
+):
+    """
+    Low-resolution ultrafast MP4 proxy of [start, end] (at most
+    PREVIEW_MAX_PROXY_SECONDS long).
+    """
+    overlays, err = parse_overlays(overlays_json)
+    if err:
+        return err
+    inputs, err = await asyncio.to_thread(preview_inputs, job_id, video_sha, asset_refs)
+    if err:
+        return err
+    base, base_sha, job_assets, workdir, probe = inputs
+    height = max(72, min(int(height), 1080))
+    out, cached, error = await preview.proxy(base, base_sha, overlays, job_assets, workdir, start, end, height, probe)
+    if error:
+        return JSONResponse(status_code=400 if out is None else 500, content={"error": "preview failed", "detail": error})
+    return FileResponse(out, media_type="video/mp4", headers={"X-Preview-Cache": "hit" if cached else "miss"})
 
 
 @app.get("/status/{job_id}")
 def status(job_id: str):
-    job = jobs.get(job_id)
+    job = get_job(job_id)
     if not job:
         return JSONResponse(status_code=404, content={"error": "not found"})
-    return job
+    return {**job, **scheduler.queue_info(job_id)}
 
 
-@app.get("/result/{job_id}")
-def result(job_id: str):
-    job = jobs.get(job_id)
+# ------------------------------
+# PUSHED PROGRESS (SSE / WebSocket)
+# ------------------------------
+
+EVENT_KEEPALIVE = 15.0
+# jobs rendered by another process only reach us through the store
+EVENT_POLL_INTERVAL = 1.0
+
+
+async def job_events(job_id: str, job: Dict[str, Any]):
+    """
+    Yields progress events for a job: its current state first, then every
+    update until it reaches a terminal status. Updates from renders in this
+    process are pushed; otherwise the store is polled. None means keepalive.
+    """
+    queue = progress_hub.subscribe(job_id)
+    try:
+        current = progress_event(job_id, job)
+        yield current
+        if current["status"] in TERMINAL_STATUSES:
+            return
+        idle = 0.0
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), EVENT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                stored = None if job_id in jobs else await asyncio.to_thread(store.get, job_id)
+                event = progress_event(job_id, stored) if stored else current
+            if event == current:
+                idle += EVENT_POLL_INTERVAL
+                if idle >= EVENT_KEEPALIVE:
+                    idle = 0.0
+                    yield None
+                continue
+            idle = 0.0
+            current = event
+            yield event
+            if event.get("status") in TERMINAL_STATUSES:
+                return
+    finally:
+        progress_hub.unsubscribe(job_id, queue)
+
+
+@app.get("/events/{job_id}")
+async def events(job_id: str):
+    """
+    Server-Sent Events stream of progress for one job.
+    """
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "not found"})
+
+    async def stream():
+        async for event in job_events(job_id, job):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/ws/{job_id}")
+async def ws_progress(websocket: WebSocket, job_id: str):
+    job = get_job(job_id)
+    await websocket.accept()
+    if not job:
+        await websocket.send_json({"error": "not found"})
+        await websocket.close()
+        return
+    try:
+        async for event in job_events(job_id, job):
+            if event is not None:
+                await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+@app.post("/cancel/{job_id}")
+def cancel(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "not found"})
+    if job["status"] in ("done", "error", "cancelled", "expired"):
+        return JSONResponse(status_code=400, content={"error": "job already finished", "status": job["status"]})
+
+    # "killed": rendering here; "signalled": the worker rendering it stops
+    # at its next heartbeat and records the cancel itself
+    action = scheduler.cancel(job_id)
+    if action not in ("killed", "signalled"):
+        # still waiting (or not known to the queue): nothing is running
+        job["status"] = "cancelled"
+        job["msg"] = "cancelled before start"
+        settle_variants(job)
+        save_job(job_id, job=job)
+        if job.get("render_key"):
+            render_cache.finish(job["render_key"], job_id)
+    return {"job_id": job_id, "cancel": action or "dequeued"}
+
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, offset: int = 0, limit: int = 50):
+    limit = max(1, min(limit, 500))
+    items, total = store.list(status=status, offset=max(0, offset), limit=limit)
+    return {"jobs": items, "total": total, "offset": offset, "limit": limit}
+
+
+@app.get("/scheduler")
+def scheduler_stats():
+    return scheduler.stats()
+
+
+@app.get("/metrics")
+def metrics_text():
+    """
+    Prometheus text exposition: request latency, upload time, per-stage
+    render timings, throughput and output bitrate histograms (shared by all
+    processes) and current queue depth.
+    """
+    gauges = [
+        ("buttercut_queue_jobs", "Jobs waiting or rendering on the shared queue.", {"state": state}, count)
+        for state, count in scheduler.queue.counts().items()
+    ]
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+@app.api_route("/result/{job_id}", methods=["GET", "HEAD"])
+def result(job_id: str, request: Request, variant: Optional[str] = None):
+    """
+    variant: name of a /batch variant; defaults to the first one.
+    Supports Range, If-Range and conditional GET (ETag / Last-Modified).
+    """
+    job = get_job(job_id)
     if not job:
         return JSONResponse(status_code=404, content={"error": "not found"})
-    if job["status"] != "done":
-        return JSONResponse(status_code=400, content={"error": "not ready", "status": job["status"]})
-    path = Path(job["out"])
+    target, filename = job, "rendered.mp4"
+    if variant is not None or job.get("variants"):
+        found = [v for v in job.get("variants") or [] if variant is None or v["name"] == variant]
+        if not found:
+            return JSONResponse(status_code=404, content={"error": "unknown variant", "variant": variant})
+        target, filename = found[0], f"rendered_{found[0]['name']}.mp4"
+    if target["status"] != "done":
+        return JSONResponse(status_code=400, content={"error": "not ready", "status": target["status"]})
+    path = Path(target["out"])
     if not path.exists():
         return JSONResponse(status_code=500, content={"error": "output missing"})
-    return FileResponse(path, media_type="video/mp4", filename="rendered.mp4")
+    if job.get("render_key"):
+        render_cache.touch(job["render_key"])
+    return delivery.serve_file(request, path, "video/mp4", filename=filename)
+
+
+HLS_FILE_RE = re.compile(r"^(index\.m3u8|init\.mp4|seg_\d+\.m4s)$")
+
+
+@app.api_route("/hls/{job_id}/{name}", methods=["GET", "HEAD"])
+def hls_file(job_id: str, name: str, request: Request):
+    """
+    Playlist and fragmented-MP4 segments of an output=hls job, available
+    while it renders. The playlist is an EVENT playlist that grows until
+    the render ends; segments never change once listed.
+    """
+    if not HLS_FILE_RE.match(name):
+        return JSONResponse(status_code=404, content={"error": "not found"})
+    job = get_job(job_id)
+    if not job or job.get("output") != "hls":
+        return JSONResponse(status_code=404, content={"error": "not found"})
+    path = Path(job["out"]).parent / "hls" / name
+    if not path.exists():
+        return JSONResponse(status_code=404, content={"error": "not ready", "status": job["status"]})
+    if name.endswith(".m3u8"):
+        return delivery.serve_file(request, path, "application/vnd.apple.mpegurl")
+    return delivery.serve_file(request, path, "video/mp4", cache_control="public, max-age=31536000, immutable")
+
+
+def asset_probe(job: Dict[str, Any], path: Path):
+    """
+    ffprobe info for a job input, from the asset store cache when possible.
+    """
+    sha = (job.get("assets") or {}).get(path.name)
+    meta = assets.metadata(sha) if sha else None
+    return (meta or {}).get("probe") or ffprobe_info(path)
+
 
+def output_stats(job: Dict[str, Any], out_path: Path, duration: float, probe: Optional[Dict[str, Any]],
+                 encode_seconds: float):
+    """
+    Output size and bitrate plus render throughput (realtime factor and
+    average fps over the whole encode, across segments or chunks).
+    """
+    size = out_path.stat().st_size
+    job["output_bytes"] = size
+    if duration:
+        job["output_bitrate_kbps"] = round(size * 8 / duration / 1000, 1)
+    if duration and encode_seconds > 0:
+        job["realtime_factor"] = round(duration / encode_seconds, 3)
+        frames = duration * (probe or {}).get("fps") if (probe or {}).get("fps") else job.get("frame")
+        if frames:
+            job["avg_fps"] = round(frames / encode_seconds, 1)
 
-def render_job(job_id: str):
+
+def settle_variants(job: Dict[str, Any]):
+    """
+    Copy a finished batch job's outcome onto its variants; a variant whose
+    output is missing after a successful run is marked error on its own.
+    """
+    for v in job.get("variants") or []:
+        ok = job["status"] == "done" and Path(v["out"]).exists()
+        v["status"] = "done" if ok else "error" if job["status"] == "done" else job["status"]
+        if ok:
+            v["progress"] = 100
+
+
+def render_job(job_id: str, threads: int = 0):
     if job_id not in jobs:
         print(f"render_job: job {job_id} missing from memory; aborting")
         return
 
     job = jobs[job_id]
+    if job.get("status") in TERMINAL_STATUSES:
+        return
+    job["started_at"] = time.time()
+    job["wait_seconds"] = round(job["started_at"] - job.get("queued_at", job["started_at"]), 3)
+    timings = job.setdefault("timings", {})
+    timings["queue_wait"] = job["wait_seconds"]
     jobdir = Path(job["video"]).parent
     overlays_path = jobdir / "overlays.json"
 
     if not overlays_path.exists():
         job["status"] = "error"
         job["msg"] = "overlays.json missing"
-        save_jobs()
+        save_job(job_id)
         return
 
     try:
@@ -167,164 +912,151 @@ def render_job(job_id: str):
     except Exception as e:
         job["status"] = "error"
         job["msg"] = f"invalid overlays.json: {e}"
-        save_jobs()
+        save_job(job_id)
         return
 
     input_video = Path(job["video"])
     if not input_video.exists():
         job["status"] = "error"
         job["msg"] = "input video missing"
-        save_jobs()
+        save_job(job_id)
         return
 
     # ------------------------------
-    # BUILD FFMPEG COMMAND
+    # PICK RENDER MODE
     # ------------------------------
-
-    cmd = ["ffmpeg", "-y", "-i", str(input_video)]
-    extra_inputs = []
-    image_indices = []
-
-    # Collect image/video overlay inputs
-    for ov in overlays:
-        if ov.get("type") in ("image", "video"):
-            filename = ov.get("content")
-            candidate = jobdir / filename
-            if candidate.exists():
-                cmd += ["-i", str(candidate)]
-                extra_inputs.append(ov)
-                image_indices.append(len(extra_inputs))  # 1-based
-
-    # Build filter_complex
-    filter_parts = []
-    current_label = "[0:v]"  # start with the base video
-    input_offset = 1  # next FFmpeg input index after base video
-
-    # First: text overlays (drawtext) → chain sequentially
-    for ov in overlays:
-        if ov.get("type") == "text":
-            txt = (ov.get("content") or "").replace("'", r"'\''").replace(":", r"\:")
-            draw = (
-                f"{current_label}"
-                f"drawtext=text='{txt}':"
-                f"x={ov.get('x', 50)}:y={ov.get('y', 50)}:"
-                f"fontsize={ov.get('fontsize', 24)}:fontcolor={ov.get('fontcolor', 'white')}:"
-                f"box=1:boxcolor=black@0.5:boxborderw=10:"
-                f"enable='between(t,{ov.get('start_time',0)},{ov.get('end_time',5)})'"
-                f"[txt{ov['id']}]"
-            )
-            filter_parts.append(draw)
-            current_label = f"[txt{ov['id']}]"
-
-    # Next: image/video overlays → chain sequentially
-    for ov in overlays:
-        if ov.get("type") in ("image", "video"):
-            idx = input_offset
-            input_offset += 1
-
-            w = ov.get("width", -1)
-            h = ov.get("height", -1)
-
-            # Scale overlay
-            filter_parts.append(
-                f"[{idx}:v]scale={w}:{h}[ov{idx}]"
-            )
-
-            # Overlay onto current chain
-            overlay = (
-                f"{current_label}[ov{idx}]overlay="
-                f"{ov.get('x',0)}:{ov.get('y',0)}:"
-                f"enable='between(t,{ov.get('start_time',0)},{ov.get('end_time',5)})'"
-                f"[tmp{idx}]"
-            )
-            filter_parts.append(overlay)
-            current_label = f"[tmp{idx}]"
-
-    # Build full command
     out_path = Path(job["out"])
     ff_log = jobdir / "ffmpeg_background.log"
+    thread_args = ["-threads", str(threads)] if threads else []
 
-    if filter_parts:
-        filter_complex = "; ".join(filter_parts)
-
-        cmd += [
-            "-filter_complex", filter_complex,
-            "-map", current_label,
-            "-map", "0:a?",
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-c:a", "copy",
-            str(out_path),
-        ]
-    else:
-        cmd += ["-c", "copy", str(out_path)]
+    t = time.time()
+    probe = asset_probe(job, input_video)
+    duration = (probe or {}).get("duration") or ffprobe_duration(input_video) or 0.0
+    timings["probe"] = round(time.time() - t, 3)
+
+    t = time.time()
+    mode = job.get("render_mode") or "auto"
+    hls = job.get("output") == "hls"
+    if hls:
+        # progressive output comes from one continuous encode
+        mode = "full"
+    if job.get("variants"):
+        # one encoder per variant share the job's thread budget
+        per_variant = max(1, threads // len(job["variants"])) if threads else 0
+        thread_args = ["-threads", str(per_variant)] if per_variant else []
+    plan = chunk_plan = None
+    if mode in ("auto", "segment"):
+        plan = segments.plan_for(input_video, overlays, duration, probe, force=(mode == "segment"))
+    if not plan and mode in ("auto", "chunked"):
+        # chunks may also use the cores of render slots idle on this host
+        chunk_plan = chunked.chunk_plan_for(input_video, duration, scheduler.cpu_budget(job_id),
+                                            force=(mode == "chunked"))
+        if not chunk_plan:
+            scheduler.return_slots(job_id)
+    job["render_mode_used"] = (
+        "batch" if job.get("variants") else "hls" if hls else
+        "segment" if plan else "chunked" if chunk_plan else "full"
+    )
+    timings["plan"] = round(time.time() - t, 3)
 
     # ------------------------------
     # RUN FFMPEG (stream stderr, update progress)
     # ------------------------------
-    duration = ffprobe_duration(input_video) or 0.0
     job["status"] = "processing"
     job["progress"] = 0
     job["msg"] = "running ffmpeg"
-    save_jobs()
+    save_job(job_id)
 
-    with ff_log.open("w", encoding="utf-8") as logf:
-        logf.write("Running ffmpeg command:\n" + " ".join(shlex.quote(p) for p in cmd) + "\n\n")
-        logf.flush()
+    def on_start(proc):
+        scheduler.register_process(job_id, proc)
+
+    def on_progress(pct: int, stats: Optional[Dict[str, Any]] = None):
+        job["progress"] = pct
+        for v in job.get("variants") or []:
+            v["status"], v["progress"] = "processing", pct
+        if stats:
+            for k in PROGRESS_FIELDS:
+                job[k] = stats.get(k)
+        elapsed = time.time() - job["started_at"]
+        job["eta_seconds"] = round(elapsed * (100 - pct) / pct, 1) if pct > 0 else None
+        save_job(job_id, coalesce=True)
 
+    def on_stats(stats: Dict[str, Any]):
+        t_sec = stats.get("out_time")
+        if t_sec is not None and duration and duration > 0:
+            on_progress(min(100, int((t_sec / duration) * 100)), stats)
+
+    encode_started = time.time()
+    with ff_log.open("w", encoding="utf-8") as logf:
         try:
-            proc = subprocess.Popen(
-                cmd,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1,
-            )
-
-            # read stderr line-by-line, update progress
-            last_lines = []
-            if proc.stderr:
-                for raw in proc.stderr:
-                    line = raw.rstrip("\n")
-                    last_lines.append(line)
-                    if len(last_lines) > 500:
-                        last_lines = last_lines[-500:]
-                    logf.write(line + "\n")
-                    logf.flush()
-
-                    # parse ffmpeg time=... and update job progress
-                    try:
-                        t_sec = parse_time_from_ffmpeg_line(line)
-                        if t_sec is not None and duration and duration > 0:
-                            pct = min(100, int((t_sec / duration) * 100))
-                            job["progress"] = pct
-                            save_jobs()
-                    except Exception:
-                        pass
-
-            # ensure process finishes and capture any remaining output
-            proc.wait()
-            stdout, stderr = proc.communicate()
-            logf.write("\n--- STDOUT ---\n")
-            logf.write(stdout or "")
-            logf.write("\n--- STDERR ---\n")
-            logf.write(stderr or "")
-            logf.flush()
-
-            if proc.returncode == 0 and out_path.exists():
+            if job.get("variants"):
+                out_paths = [Path(v["out"]) for v in job["variants"]]
+                logf.write(f"Batch render: {len(out_paths)} variants from one decode\n\n")
+                cmd = build_batch_cmd(input_video, overlays, jobdir, out_paths, thread_args=thread_args, probe=probe)
+                returncode = run_ffmpeg(cmd, logf, on_stats=on_stats, on_start=on_start)
+                out_path = out_paths[0]
+            elif plan:
+                encoded = sum(seg["end"] - seg["start"] for seg in plan if seg["encode"])
+                logf.write(f"Segment render: re-encoding {encoded:.2f}s of {duration:.2f}s in {len(plan)} segments\n\n")
+                returncode = segments.render_segmented(
+                    input_video, overlays, jobdir, out_path, plan, probe, logf, thread_args,
+                    on_start=on_start, on_progress=on_progress,
+                    is_cancelled=lambda: scheduler.is_cancelled(job_id),
+                )
+            elif chunk_plan:
+                returncode = chunked.render_chunked(
+                    input_video, overlays, jobdir, out_path, chunk_plan, probe, logf,
+                    on_start=on_start, on_progress=on_progress,
+                    is_cancelled=lambda: scheduler.is_cancelled(job_id),
+                )
+            elif hls:
+                hls_dir = jobdir / "hls"
+                shutil.rmtree(hls_dir, ignore_errors=True)
+                hls_dir.mkdir()
+                playlist = hls_dir / "index.m3u8"
+                cmd = build_render_cmd(
+                    input_video, overlays, jobdir, playlist, thread_args=thread_args,
+                    out_args=hls_output_args(hls_dir), encode=True, probe=probe,
+                )
+                returncode = run_ffmpeg(cmd, logf, on_stats=on_stats, on_start=on_start)
+                if returncode == 0 and not scheduler.is_cancelled(job_id):
+                    # same segments joined into a plain MP4 for /result
+                    cmd = ["ffmpeg", "-y", "-i", str(playlist), "-c", "copy", *MP4_ARGS, str(out_path)]
+                    returncode = run_ffmpeg(cmd, logf, on_start=on_start)
+            else:
+                cmd = build_render_cmd(
+                    input_video, overlays, jobdir, out_path, thread_args=thread_args, out_args=MP4_ARGS, probe=probe,
+                )
+                returncode = run_ffmpeg(cmd, logf, on_stats=on_stats, on_start=on_start)
+
+            timings["encode"] = round(time.time() - encode_started, 3)
+
+            if not scheduler.owns(job_id):
+                # lease expired and another worker re-rendered it; leave its state alone
+                logf.write("\nlease lost to another worker; result discarded\n")
+                return
+            if scheduler.is_cancelled(job_id):
+                job["status"] = "cancelled"
+                job["msg"] = "cancelled while rendering"
+            elif returncode == 0 and out_path.exists():
                 job["status"] = "done"
                 job["progress"] = 100
                 job["msg"] = "render complete"
+                output_stats(job, out_path, duration, probe, timings["encode"])
             else:
                 job["status"] = "error"
-                job["msg"] = f"ffmpeg returned {proc.returncode}; see ffmpeg_background.log"
+                job["msg"] = f"ffmpeg returned {returncode}; see ffmpeg_background.log"
+            job.pop("eta_seconds", None)
+            settle_variants(job)
+            timings["total"] = round(time.time() - job.get("queued_at", job["started_at"]), 3)
 
-            save_jobs()
+            save_job(job_id)
 
         except Exception as e:
             job["status"] = "error"
             job["msg"] = f"exception: {e}"
-            save_jobs()
+            settle_variants(job)
+            save_job(job_id)
             try:
                 with ff_log.open("a", encoding="utf-8") as logf2:
                     logf2.write(f"\nEXCEPTION: {e}\n")
@@ -332,3 +1064,14 @@ def render_job(job_id: str):
                 pass
 
     return
+
+
+def start_background():
+    """
+    Re-queue pending jobs and, unless RENDER_ROLE=api, start this
+    process's render workers. Runs at app startup, or from worker.py.
+    """
+    recover_jobs()
+    if RENDER_ROLE in ("all", "worker"):
+        scheduler.start()
+
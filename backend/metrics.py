@@ -0,0 +1,199 @@
+# metrics.py
+#
+# Prometheus-style counters and histograms without extra dependencies.
+# Observations are buffered in memory and added to a SQLite table every
+# METRICS_FLUSH_INTERVAL seconds, so every process (API servers and render
+# workers) contributes to the same numbers and any of them can serve
+# /metrics.
+import os
+import json
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from job_store import thread_connection
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5.0"))
+
+# seconds, from fast API calls up to long renders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class MetricsRegistry:
+    """
+    Named counters and histograms with free-form labels. Definitions are
+    per process; samples are shared through the database.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str, Sequence[float]]] = {}  # name -> (type, help, buckets)
+        self._pending: Dict[Tuple[str, str, str], float] = {}  # (name, labels json, suffix) -> delta
+        self._thread: Optional[threading.Thread] = None
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS metric_samples (
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                suffix TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (name, labels, suffix)
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    # ------------------------------
+    # definitions
+    # ------------------------------
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._meta[name] = ("histogram", help_text, tuple(sorted(buckets)))
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text, ())
+
+    # ------------------------------
+    # recording
+    # ------------------------------
+
+    def observe(self, name: str, value: Optional[float], **labels):
+        if value is None or not math.isfinite(value):
+            return
+        _, _, buckets = self._meta[name]
+        key = _labels_key(labels)
+        # buckets are stored cumulatively, as exposed
+        with self._lock:
+            for b in buckets:
+                if value <= b:
+                    self._add(name, key, f"le={_fmt(b)}", 1)
+            self._add(name, key, "le=+Inf", 1)
+            self._add(name, key, "sum", value)
+            self._add(name, key, "count", 1)
+        self._ensure_flusher()
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        with self._lock:
+            self._add(name, _labels_key(labels), "total", amount)
+        self._ensure_flusher()
+
+    def _add(self, name: str, key: str, suffix: str, amount: float):
+        k = (name, key, suffix)
+        self._pending[k] = self._pending.get(k, 0.0) + amount
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO metric_samples (name, labels, suffix, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name, labels, suffix) DO UPDATE SET value = value + excluded.value",
+                [(name, key, suffix, value) for (name, key, suffix), value in pending.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception as e:
+            print("metrics flush error", e)
+            try:
+                conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            with self._lock:
+                for k, v in pending.items():
+                    self._pending[k] = self._pending.get(k, 0.0) + v
+
+    # ------------------------------
+    # exposition
+    # ------------------------------
+
+    def render(self, gauges: Optional[List[Tuple[str, str, Dict[str, str], float]]] = None) -> str:
+        """
+        Prometheus text format of everything recorded by all processes, plus
+        gauges given as (name, help, labels, value) computed by the caller.
+        """
+        self.flush()
+        rows = self._conn().execute("SELECT name, labels, suffix, value FROM metric_samples").fetchall()
+        by_name: Dict[str, List[Tuple[str, str, float]]] = {}
+        for name, key, suffix, value in rows:
+            by_name.setdefault(name, []).append((key, suffix, value))
+
+        lines = []
+        for name in sorted(self._meta):
+            kind, help_text, buckets = self._meta[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            samples = by_name.get(name, [])
+            if kind == "counter":
+                for key, _, value in sorted(samples):
+                    lines.append(f"{name}_total{_labels_text(key)} {_fmt(value)}")
+                continue
+            series: Dict[str, Dict[str, float]] = {}
+            for key, suffix, value in samples:
+                series.setdefault(key, {})[suffix] = value
+            for key in sorted(series):
+                vals = series[key]
+                for b in buckets:
+                    le = f"le={_fmt(b)}"
+                    lines.append(f"{name}_bucket{_labels_text(key, le=_fmt(b))} {_fmt(vals.get(le, 0.0))}")
+                lines.append(f'{name}_bucket{_labels_text(key, le="+Inf")} {_fmt(vals.get("le=+Inf", 0.0))}')
+                lines.append(f"{name}_sum{_labels_text(key)} {_fmt(vals.get('sum', 0.0))}")
+                lines.append(f"{name}_count{_labels_text(key)} {_fmt(vals.get('count', 0.0))}")
+
+        for name, help_text, labels, value in gauges or []:
+            if f"# TYPE {name} gauge" not in lines:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_labels_text(_labels_key(labels))} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels_key(labels: Dict[str, str]) -> str:
+    return json.dumps({k: str(v) for k, v in labels.items()}, sort_keys=True)
+
+
+def _labels_text(key: str, **extra) -> str:
+    labels = {**json.loads(key), **extra}
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def open_metrics() -> MetricsRegistry:
+    """
+    METRICS_DB (default: the JOBS_DB file) holds the shared samples.
+    """
+    return MetricsRegistry(Path(os.environ.get("METRICS_DB") or os.environ.get("JOBS_DB", "jobs.db")))
@@ -0,0 +1,147 @@
+# preview.py
+#
+# Fast previews for the editor, outside the render queue:
+#  - a single composited JPEG frame at time t (input seeking + only the
+#    overlays active at t)
+#  - a low-resolution ultrafast proxy of a time range
+# Both go through the same overlay compiler as render_job and are cached
+# per (base asset, overlay spec, t / range), so scrubbing back and forth
+# only runs ffmpeg once per position.
+import os
+import asyncio
+import hashlib
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from render import build_render_cmd
+from render_cache import render_key
+from segments import shift_overlays
+from filtergraph import window
+
+PREVIEW_DIR = Path("previews")
+PREVIEW_DIR.mkdir(exist_ok=True)
+
+PREVIEW_CONCURRENCY = int(os.environ.get("PREVIEW_CONCURRENCY", "2"))
+PREVIEW_MAX_PROXY_SECONDS = float(os.environ.get("PREVIEW_MAX_PROXY_SECONDS", "30"))
+PREVIEW_CACHE_MAX_FILES = int(os.environ.get("PREVIEW_CACHE_MAX_FILES", "2000"))
+PREVIEW_TIMEOUT = float(os.environ.get("PREVIEW_TIMEOUT", "60"))
+
+FRAME_ARGS = ["-frames:v", "1", "-c:v", "mjpeg", "-q:v", "4", "-pix_fmt", "yuvj420p", "-f", "image2"]
+PROXY_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "32", "-pix_fmt", "yuv420p"]
+
+# held while ffmpeg runs (in a thread), so waiting requests block no thread
+_slots = asyncio.Semaphore(PREVIEW_CONCURRENCY)
+
+
+def active_at(overlays: List[Dict[str, Any]], t: float) -> List[Dict[str, Any]]:
+    return [ov for ov in overlays if window(ov)[0] <= t < window(ov)[1]]
+
+
+def _cache_path(key: str, ext: str) -> Path:
+    return PREVIEW_DIR / key[:2] / f"{key}.{ext}"
+
+
+def _run(cmd: List[str], out: Path) -> Optional[str]:
+    """
+    Run ffmpeg into a temp file and move it into place; returns an error
+    message or None.
+    """
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f".{out.name}.{threading.get_ident()}.tmp")
+    cmd = cmd[:-1] + [str(tmp)]
+    try:
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True, timeout=PREVIEW_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        tmp.unlink(missing_ok=True)
+        return "preview timed out"
+    if p.returncode != 0 or not tmp.exists():
+        tmp.unlink(missing_ok=True)
+        lines = (p.stderr or "").strip().splitlines()
+        return lines[-1] if lines else "ffmpeg failed"
+    tmp.replace(out)
+    _trim_cache()
+    return None
+
+
+async def _render(cmd: List[str], out: Path) -> Optional[str]:
+    async with _slots:
+        return await asyncio.to_thread(_run, cmd, out)
+
+
+def _trim_cache():
+    files = [f for f in PREVIEW_DIR.glob("*/*")
+             if f.parent.name != "work" and f.is_file() and not f.name.startswith(".")]
+    if len(files) <= PREVIEW_CACHE_MAX_FILES:
+        return
+    files.sort(key=lambda f: f.stat().st_atime)
+    for f in files[:len(files) - PREVIEW_CACHE_MAX_FILES]:
+        f.unlink(missing_ok=True)
+
+
+def workdir_for(job_assets: Dict[str, str], link) -> Path:
+    """
+    Folder holding the referenced assets under their overlay filenames, for
+    previews that are not tied to an existing job folder.
+    """
+    digest = hashlib.sha256(repr(sorted(job_assets.items())).encode("utf-8")).hexdigest()
+    wdir = PREVIEW_DIR / "work" / digest[:32]
+    if not wdir.exists():
+        tmp = wdir.with_name(f".{wdir.name}.{threading.get_ident()}")
+        tmp.mkdir(parents=True, exist_ok=True)
+        for fname, sha in job_assets.items():
+            link(sha, tmp / os.path.basename(fname))
+        try:
+            tmp.replace(wdir)
+        except OSError:
+            pass  # another request built it first
+    return wdir
+
+
+async def frame(base: Path, base_sha: str, overlays: List[Dict[str, Any]], job_assets: Dict[str, str],
+                workdir: Path, t: float, probe: Optional[Dict[str, Any]]):
+    """
+    Returns (jpeg path, cached?, error). Only overlays visible at t are
+    compiled, shifted so t becomes local time 0.
+    """
+    t = round(max(0.0, t), 3)
+    active = active_at(overlays, t)
+    key = render_key(base_sha, active, job_assets, {"preview": "frame", "t": t, "args": FRAME_ARGS})
+    out = _cache_path(key, "jpg")
+    if out.exists():
+        os.utime(out)
+        return out, True, None
+
+    cmd = build_render_cmd(
+        base, shift_overlays(active, t, 1.0), workdir, out,
+        seek=(t, 1.0), encode=True, probe=probe, video_args=FRAME_ARGS, audio=False,
+    )
+    return out, False, await _render(cmd, out)
+
+
+async def proxy(base: Path, base_sha: str, overlays: List[Dict[str, Any]], job_assets: Dict[str, str],
+                workdir: Path, start: float, end: float, height: int, probe: Optional[Dict[str, Any]]):
+    """
+    Returns (mp4 path, cached?, error) for a low-res proxy of [start, end].
+    """
+    start = round(max(0.0, start), 3)
+    end = round(min(end, start + PREVIEW_MAX_PROXY_SECONDS), 3)
+    if end <= start:
+        return None, False, "empty range"
+    length = end - start
+    visible = shift_overlays(overlays, start, length)
+    key = render_key(base_sha, visible, job_assets,
+                     {"preview": "proxy", "start": start, "end": end, "height": height, "args": PROXY_ARGS})
+    out = _cache_path(key, "mp4")
+    if out.exists():
+        os.utime(out)
+        return out, True, None
+
+    cmd = build_render_cmd(
+        base, visible, workdir, out,
+        seek=(start, length), encode=True, probe=probe, video_args=PROXY_ARGS,
+        post_filter=f"scale=-2:{int(height)}", out_args=["-movflags", "+faststart", "-f", "mp4"],
+    )
+    return out, False, await _render(cmd, out)
@@ -0,0 +1,61 @@
+# progress.py
+import asyncio
+import threading
+from typing import Any, Dict, List, Tuple
+
+# statuses after which a job's event stream ends
+TERMINAL_STATUSES = ("done", "error", "cancelled", "expired")
+
+# per-subscriber backlog; a slow client only ever misses intermediate updates
+QUEUE_SIZE = 16
+
+
+class ProgressHub:
+    """
+    Fans job progress events out to async subscribers (SSE / WebSocket).
+    publish() may be called from any thread, typically a render worker.
+    Only renders in this process publish here; subscribers get the job's
+    current state from the store themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def publish(self, job_id: str, event: Dict[str, Any]):
+        with self._lock:
+            subs = list(self._subs.get(job_id, ()))
+        for loop, queue in subs:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subs.setdefault(job_id, []).append((loop, queue))
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subs = [s for s in self._subs.get(job_id, []) if s[1] is not queue]
+            if subs:
+                self._subs[job_id] = subs
+            else:
+                self._subs.pop(job_id, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._subs.values())
+
+
+def _offer(queue: asyncio.Queue, event: Dict[str, Any]):
+    # drop the oldest pending update rather than block the publisher
+    if queue.full():
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    queue.put_nowait(event)
@@ -0,0 +1,223 @@
+# render.py
+import os
+import shlex
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ffmpeg_utils import ProgressParser
+from filtergraph import compile_overlays
+
+ENCODE_ARGS = ["-c:v", "libx264", "-preset", "fast"]
+# final MP4s carry their index (moov) up front so playback can start at once
+MP4_ARGS = ["-movflags", "+faststart"]
+
+HLS_SEGMENT_SECONDS = float(os.environ.get("HLS_SEGMENT_SECONDS", "4"))
+
+# ffprobe H.264 profile names -> libx264 -profile values
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+}
+# pixel formats any (8-bit) libx264 build can write
+X264_PIX_FMTS = ("yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p")
+
+
+def hls_output_args(hls_dir: Path, segment_seconds: float = HLS_SEGMENT_SECONDS) -> List[str]:
+    """
+    Output options for a progressive HLS render into hls_dir: fragmented MP4
+    segments cut every segment_seconds and an EVENT playlist that ffmpeg
+    appends to as each segment completes, so playback can start while the
+    render continues. Segments are written to a temp name and renamed, so a
+    listed segment is always complete.
+    """
+    return [
+        "-force_key_frames", f"expr:gte(t,n_forced*{_seconds(segment_seconds)})",
+        "-f", "hls",
+        "-hls_time", _seconds(segment_seconds),
+        "-hls_playlist_type", "event",
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_flags", "temp_file+independent_segments",
+        "-hls_segment_filename", str(hls_dir / "seg_%05d.m4s"),
+    ]
+
+
+def _seconds(v: float) -> str:
+    return f"{v:g}"
+
+
+def matching_encode_args(probe: Optional[Dict[str, Any]]) -> Optional[List[str]]:
+    """
+    libx264 settings whose output can be stream-copy concatenated with the
+    source's own H.264: same profile, level, pixel format and (for constant
+    frame rate sources) frame rate. Resolution is kept by the overlay chain
+    and MPEG-TS pieces all use the 90 kHz timebase. None when the source
+    uses something we cannot reproduce (10-bit, unknown profile, missing
+    probe); such videos must be re-encoded as a whole.
+    """
+    probe = probe or {}
+    profile = X264_PROFILES.get(probe.get("profile") or "")
+    pix_fmt = probe.get("pix_fmt")
+    if probe.get("codec") != "h264" or profile is None or pix_fmt not in X264_PIX_FMTS:
+        return None
+    args = [*ENCODE_ARGS, "-profile:v", profile, "-pix_fmt", pix_fmt]
+    level = probe.get("level")
+    if isinstance(level, int) and level >= 10:
+        args += ["-level:v", f"{level / 10:g}"]
+    rate = _rate(probe.get("frame_rate"))
+    if rate and probe.get("fps") and abs(rate - probe["fps"]) / rate < 0.01:
+        args += ["-r", probe["frame_rate"]]
+    return args
+
+
+def _rate(v: Optional[str]) -> Optional[float]:
+    try:
+        n, d = (v or "").split("/", 1)
+        return float(n) / float(d) if float(d) else None
+    except ValueError:
+        return None
+
+
+def build_render_cmd(input_video: Path, overlays: List[Dict[str, Any]], jobdir: Path, out_path: Path,
+                     thread_args: Optional[List[str]] = None, seek: Optional[Tuple[float, float]] = None,
+                     out_args: Optional[List[str]] = None, encode: bool = False,
+                     probe: Optional[Dict[str, Any]] = None, video_args: Optional[List[str]] = None,
+                     post_filter: Optional[str] = None, audio: bool = True) -> List[str]:
+    """
+    Full ffmpeg command for rendering overlays onto input_video.
+    seek=(start, duration) renders just that part of the base video, with
+    overlay times already shifted to be relative to start.
+    out_args go right before the output path (e.g. a container format).
+    Without overlays the video is stream-copied unless encode=True.
+    probe (ffprobe_info of input_video) lets the graph drop overlays that
+    are off-frame or past the end.
+    video_args replace the default libx264 settings, post_filter (e.g. a
+    scale) runs after all overlays, audio=False drops the audio stream.
+    """
+    cmd = ["ffmpeg", "-y"]
+    if seek is not None:
+        cmd += ["-ss", f"{seek[0]:.6f}", "-t", f"{seek[1]:.6f}"]
+    cmd += ["-i", str(input_video)]
+
+    probe = probe or {}
+    graph = compile_overlays(
+        overlays, jobdir,
+        duration=seek[1] if seek else probe.get("duration"),
+        frame=(probe.get("width"), probe.get("height")),
+        input_seek=seek[0] if seek else 0.0,
+    )
+    cmd += graph.input_args
+
+    filter_parts, out_label = list(graph.filter_parts), graph.out_label
+    if post_filter:
+        filter_parts.append(f"{out_label}{post_filter}[post]")
+        out_label = "[post]"
+
+    audio_args = ["-map", "0:a?", "-c:a", "copy"] if audio else ["-an"]
+    if filter_parts:
+        cmd += [
+            "-filter_complex", "; ".join(filter_parts),
+            "-map", out_label,
+            *audio_args,
+            *(video_args or ENCODE_ARGS),
+            *(thread_args or []),
+        ]
+    elif encode:
+        cmd += ["-map", "0:v", *audio_args, *(video_args or ENCODE_ARGS), *(thread_args or [])]
+    else:
+        cmd += ["-c", "copy"]
+    cmd += [*(out_args or []), str(out_path)]
+    return cmd
+
+
+def build_batch_cmd(input_video: Path, variants: List[List[Dict[str, Any]]], jobdir: Path,
+                    out_paths: List[Path], thread_args: Optional[List[str]] = None,
+                    probe: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    One ffmpeg command rendering every overlay list in variants onto the
+    same base video. The base is decoded once and fanned out with split;
+    each variant gets its own overlay chain and encoder writing to the
+    matching out_paths entry. Variants with nothing to draw are
+    stream-copied.
+    """
+    probe = probe or {}
+    cmd = ["ffmpeg", "-y", "-i", str(input_video)]
+    graphs = []
+    next_input = 1
+    for i, overlays in enumerate(variants):
+        graph = compile_overlays(
+            overlays, jobdir,
+            duration=probe.get("duration"),
+            frame=(probe.get("width"), probe.get("height")),
+            base_label=f"[base{i}]", input_offset=next_input, prefix=f"v{i}",
+        )
+        cmd += graph.input_args
+        next_input += graph.num_inputs
+        graphs.append(graph)
+
+    drawn = [i for i, g in enumerate(graphs) if g.filter_parts]
+    if drawn:
+        filter_parts = [f"[0:v]split={len(drawn)}" + "".join(f"[base{i}]" for i in drawn)]
+        for i in drawn:
+            filter_parts += graphs[i].filter_parts
+        cmd += ["-filter_complex", "; ".join(filter_parts)]
+
+    for i, out_path in enumerate(out_paths):
+        if i in drawn:
+            cmd += ["-map", graphs[i].out_label, "-map", "0:a?", "-c:a", "copy", *ENCODE_ARGS, *(thread_args or [])]
+        else:
+            cmd += ["-map", "0:v", "-map", "0:a?", "-c", "copy"]
+        cmd += [*MP4_ARGS, str(out_path)]
+    return cmd
+
+
+def run_ffmpeg(cmd: List[str], logf, on_stats: Optional[Callable[[Dict[str, Any]], None]] = None,
+               on_start: Optional[Callable[[subprocess.Popen], None]] = None) -> int:
+    """
+    Run ffmpeg with machine-readable -progress output on stdout. Each
+    progress block is parsed (frame, fps, out_time, bitrate, speed) and
+    passed to on_stats; stderr is streamed into logf. Returns the exit code.
+    """
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    logf.write("Running ffmpeg command:\n" + " ".join(shlex.quote(p) for p in cmd) + "\n\n")
+    logf.flush()
+
+    proc = subprocess.Popen(
+        cmd,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        bufsize=1,
+    )
+    if on_start is not None:
+        on_start(proc)
+
+    # stderr goes to the log from its own thread so neither pipe can fill up
+    def drain_stderr():
+        for raw in proc.stderr:
+            logf.write(raw)
+        logf.flush()
+
+    err_thread = threading.Thread(target=drain_stderr, daemon=True)
+    err_thread.start()
+
+    parser = ProgressParser()
+    for raw in proc.stdout:
+        stats = parser.feed(raw)
+        if stats is not None and on_stats is not None:
+            try:
+                on_stats(stats)
+            except Exception as e:
+                print("progress callback error", e)
+
+    proc.wait()
+    err_thread.join()
+    logf.write(f"\n--- ffmpeg exited with {proc.returncode} ---\n\n")
+    logf.flush()
+    return proc.returncode
@@ -0,0 +1,165 @@
+# render_cache.py
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from job_store import thread_connection
+
+# bump when rendering changes in a way that alters output for the same inputs
+CACHE_VERSION = 2
+
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+RENDER_CACHE_MAX_AGE = float(os.environ.get("RENDER_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+# fields the frontend sends that do not affect the rendered pixels
+_IGNORED_FIELDS = ("id", "contentUri", "text")
+
+
+def normalize_overlays(overlays: List[Dict[str, Any]], job_assets: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Canonical form of an overlay list: client-only fields dropped, numbers
+    as floats, media referenced by content hash instead of filename.
+    """
+    norm = []
+    for ov in overlays:
+        item = {}
+        for k, v in ov.items():
+            if k in _IGNORED_FIELDS:
+                continue
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                v = float(v)
+            item[k] = v
+        if ov.get("type") in ("image", "video"):
+            item["content"] = job_assets.get(ov.get("content"), ov.get("content"))
+        norm.append(item)
+    return norm
+
+
+def render_key(base_sha: str, overlays: List[Dict[str, Any]], job_assets: Dict[str, str],
+               settings: Dict[str, Any]) -> str:
+    payload = {
+        "v": CACHE_VERSION,
+        "base": base_sha,
+        "overlays": normalize_overlays(overlays, job_assets),
+        "settings": settings,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Maps render keys to finished outputs (LRU under a byte and age budget)
+    and to in-flight jobs, so identical submissions share one render.
+    Both live in SQLite, shared by every API and worker process.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = RENDER_CACHE_MAX_BYTES, max_age: float = RENDER_CACHE_MAX_AGE):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._local = threading.local()
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS render_cache (
+                key TEXT PRIMARY KEY,
+                job_id TEXT NOT NULL,
+                out TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS render_cache_lru_idx ON render_cache (last_access);
+            CREATE TABLE IF NOT EXISTS render_inflight (
+                key TEXT PRIMARY KEY,
+                job_id TEXT NOT NULL
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        return thread_connection(self._local, self.path)
+
+    # ------------------------------
+    # finished outputs
+    # ------------------------------
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        job_id of a finished render for key, if its output still exists.
+        """
+        conn = self._conn()
+        row = conn.execute("SELECT job_id, out FROM render_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if not Path(row[1]).exists():
+            conn.execute("DELETE FROM render_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE render_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def touch(self, key: str):
+        self._conn().execute("UPDATE render_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+
+    def add(self, key: str, job_id: str, out: Path):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO render_cache (key, job_id, out, size, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, job_id, str(out), Path(out).stat().st_size, now, now),
+        )
+        self.finish(key, job_id)
+
+    def evict(self, on_evict: Optional[Callable[[str], None]] = None) -> int:
+        """
+        Delete outputs older than max_age, then least recently used ones until
+        the total fits max_bytes. on_evict(job_id) is called for each.
+        Returns the number of evicted outputs.
+        """
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT key, job_id, out, size, created_at FROM render_cache ORDER BY last_access"
+        ).fetchall()
+        total = sum(r[3] for r in rows)
+        now = time.time()
+        evicted = 0
+        for key, job_id, out, size, created_at in rows:
+            expired = self.max_age and now - created_at > self.max_age
+            if not expired and total <= self.max_bytes:
+                continue
+            try:
+                Path(out).unlink()
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print("render cache evict error", out, e)
+                continue
+            conn.execute("DELETE FROM render_cache WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+            if on_evict is not None:
+                on_evict(job_id)
+        return evicted
+
+    # ------------------------------
+    # in-flight coalescing
+    # ------------------------------
+
+    def claim(self, key: str, job_id: str) -> Optional[str]:
+        """
+        Register job_id as the render for key. If another job is already
+        rendering it, returns that job's id instead (and registers nothing).
+        Claims live in the database, so they coalesce across API processes.
+        """
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO render_inflight (key, job_id) VALUES (?, ?)", (key, job_id))
+        row = conn.execute("SELECT job_id FROM render_inflight WHERE key = ?", (key,)).fetchone()
+        current = row[0] if row else None
+        return current if current != job_id else None
+
+    def finish(self, key: str, job_id: str):
+        self._conn().execute("DELETE FROM render_inflight WHERE key = ? AND job_id = ?", (key, job_id))
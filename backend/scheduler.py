@@ -0,0 +1,256 @@
+# scheduler.py
+import os
+import uuid
+import socket
+import threading
+import time
+from typing import Callable, Dict, Any, Optional
+
+from job_queue import JobQueue, LEASE_SECONDS
+
+# how often idle workers look for jobs submitted by other processes
+POLL_INTERVAL = float(os.environ.get("RENDER_POLL_INTERVAL", "1.0"))
+
+
+def default_worker_count() -> int:
+    """
+    Number of concurrent renders per host, shared by every process on it
+    (uvicorn --workers, worker.py). libx264 already spreads one encode over
+    several cores, so we run far fewer encoders than we have cores.
+    """
+    env = os.environ.get("RENDER_WORKERS")
+    if env:
+        try:
+            return max(1, int(env))
+        except ValueError:
+            pass
+    cores = os.cpu_count() or 1
+    return max(1, cores // 4)
+
+
+def default_threads_per_job(workers: int) -> int:
+    """
+    ffmpeg -threads budget per job so that all running encodes together
+    roughly match the core count instead of oversubscribing it.
+    """
+    env = os.environ.get("FFMPEG_THREADS")
+    if env:
+        try:
+            return max(1, int(env))
+        except ValueError:
+            pass
+    cores = os.cpu_count() or 1
+    return max(1, cores // max(1, workers))
+
+
+class RenderScheduler:
+    """
+    Pool of render workers fed from the shared JobQueue. Every process
+    that runs one (the API server, or a worker.py process) claims
+    jobs under a lease and renews it from a heartbeat thread, so a job is
+    rendered by exactly one worker and is picked up again if that worker
+    dies. At most `workers` jobs render at once per host, however many
+    processes start a scheduler. submit(), cancel() and queue_info() also
+    work in processes that never call start().
+    """
+
+    def __init__(self, target: Callable[[str, int], None], queue: JobQueue, workers: Optional[int] = None,
+                 threads_per_job: Optional[int] = None,
+                 on_dead: Optional[Callable[[str, bool], None]] = None):
+        self.target = target
+        self.queue = queue
+        self.on_dead = on_dead
+        self.workers = workers or default_worker_count()
+        self.threads_per_job = threads_per_job or default_threads_per_job(self.workers)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self._running: Dict[str, Dict[str, Any]] = {}  # job_id -> {"procs", "started"}
+        self._cancelled = set()
+        self._lost = set()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        self.queue.check_host(socket.gethostname())
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"render-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._heartbeat, name="render-heartbeat", daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"Render scheduler {self.worker_id} started: {self.workers} workers, "
+              f"{self.threads_per_job} ffmpeg threads each")
+
+    def cpu_budget(self, job_id: str) -> int:
+        """
+        ffmpeg threads job_id may use: its own share plus the shares of
+        render slots idle on this host, which it borrows until it is
+        released (claims count them, so the host is never oversubscribed).
+        A lone long render can use every core; jobs arriving meanwhile wait.
+        """
+        try:
+            extra = self.queue.reserve_slots(job_id, self.worker_id, self.workers - 1, self.workers)
+        except Exception as e:
+            print("render scheduler: reserve_slots failed", e)
+            extra = 0
+        return self.threads_per_job * (1 + extra)
+
+    def return_slots(self, job_id: str):
+        """
+        Give back slots borrowed by cpu_budget() that the job will not use.
+        """
+        try:
+            self.queue.reserve_slots(job_id, self.worker_id, 0, self.workers)
+        except Exception as e:
+            print("render scheduler: reserve_slots failed", e)
+
+    def submit(self, job_id: str, priority: int = 0, queued_at: Optional[float] = None):
+        self.queue.enqueue(job_id, priority, queued_at)
+        with self._cond:
+            self._cond.notify()
+
+    def _claim(self) -> Optional[str]:
+        try:
+            job_id, dead = self.queue.claim(self.worker_id, LEASE_SECONDS, host_limit=self.workers)
+        except Exception as e:
+            print("render worker: claim failed", e)
+            return None
+        for dead_id, cancelled in dead:
+            print(f"render worker: job {dead_id} lost its worker; giving up")
+            if self.on_dead is not None:
+                try:
+                    self.on_dead(dead_id, cancelled)
+                except Exception as e:
+                    print("render worker: on_dead error", e)
+        return job_id
+
+    def _worker(self):
+        while True:
+            job_id = self._claim()
+            if job_id is None:
+                with self._cond:
+                    self._cond.wait(POLL_INTERVAL)
+                continue
+            with self._cond:
+                self._running[job_id] = {"procs": [], "started": time.time()}
+
+            try:
+                self.target(job_id, self.threads_per_job)
+            except Exception as e:
+                print(f"render worker: job {job_id} crashed: {e}")
+            finally:
+                try:
+                    self.queue.release(job_id, self.worker_id)
+                except Exception as e:
+                    print("render worker: release failed", e)
+                with self._cond:
+                    self._running.pop(job_id, None)
+                    self._cancelled.discard(job_id)
+                    self._lost.discard(job_id)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(LEASE_SECONDS / 3)
+            with self._cond:
+                running = list(self._running)
+            for job_id in running:
+                try:
+                    state = self.queue.heartbeat(job_id, self.worker_id, LEASE_SECONDS)
+                except Exception as e:
+                    print("render heartbeat error", job_id, e)
+                    continue
+                if state == "lost":
+                    print(f"render heartbeat: lease on {job_id} lost; stopping it here")
+                    with self._cond:
+                        self._lost.add(job_id)
+                if state != "ok":
+                    self._stop(job_id)
+
+    # ------------------------------
+    # queue introspection
+    # ------------------------------
+
+    def queue_info(self, job_id: str) -> Dict[str, Any]:
+        try:
+            return self.queue.position(job_id)
+        except Exception as e:
+            print("queue position error", e)
+            return {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            local = len(self._running)
+        return {
+            "worker_id": self.worker_id,
+            "workers": self.workers if self._threads else 0,
+            "threads_per_job": self.threads_per_job,
+            "running_here": local,
+            **self.queue.counts(),
+        }
+
+    # ------------------------------
+    # cancellation
+    # ------------------------------
+
+    def register_process(self, job_id: str, proc):
+        """
+        Track an ffmpeg process of a running job (a job may run several,
+        e.g. parallel chunks) so cancel() can kill it.
+        """
+        with self._cond:
+            slot = self._running.get(job_id)
+            if slot is not None:
+                slot["procs"] = [p for p in slot["procs"] if p.poll() is None] + [proc]
+            cancelled = job_id in self._cancelled
+        if cancelled:
+            _kill(proc)
+
+    def is_cancelled(self, job_id: str) -> bool:
+        with self._cond:
+            return job_id in self._cancelled
+
+    def owns(self, job_id: str) -> bool:
+        """
+        False once the job's lease was lost to another worker; its result
+        must then not be written from here.
+        """
+        with self._cond:
+            return job_id not in self._lost
+
+    def _stop(self, job_id: str) -> bool:
+        with self._cond:
+            slot = self._running.get(job_id)
+            if slot is None:
+                return False
+            self._cancelled.add(job_id)
+            procs = list(slot["procs"])
+        for proc in procs:
+            _kill(proc)
+        return True
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Returns "killed" if the job was running in this process (its ffmpeg
+        processes are killed), "signalled" if another worker runs it (it
+        stops at that worker's next heartbeat), "dequeued" if it was still
+        waiting, or None if the queue does not know it.
+        """
+        if self._stop(job_id):
+            return "killed"
+        return self.queue.request_cancel(job_id)
+
+
+def _kill(proc):
+    try:
+        if proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except Exception:
+                proc.kill()
+    except Exception as e:
+        print("scheduler kill error", e)
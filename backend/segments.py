@@ -0,0 +1,178 @@
+# segments.py
+#
+# Segment-aware rendering: only the parts of the base video that overlays
+# touch are re-encoded; everything else is stream-copied, and the pieces are
+# joined with the concat demuxer. Cuts land on keyframes so the copied
+# pieces stay decodable. Pieces are written as MPEG-TS so re-encoded and
+# copied H.264 can be joined even though their SPS/PPS differ; re-encoded
+# pieces use the source's profile, level, pixel format and frame rate.
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ffmpeg_utils import ffprobe_keyframes, concat_copy_cmd, write_concat_list
+from render import build_render_cmd, run_ffmpeg, matching_encode_args, MP4_ARGS
+from filtergraph import window
+
+# auto mode only pays off if most of the video can be copied
+SEGMENT_MAX_FRACTION = float(os.environ.get("RENDER_SEGMENT_MAX_FRACTION", "0.5"))
+# codecs whose bitstream we can cut and concat without re-encoding
+SEGMENT_CODECS = ("h264",)
+# relative cost of a copied second vs an encoded second, for progress
+COPY_WEIGHT = 0.05
+
+TS_ARGS = ["-bsf:v", "h264_mp4toannexb", "-f", "mpegts"]
+
+
+def overlay_windows(overlays: List[Dict[str, Any]], duration: float) -> List[Tuple[float, float]]:
+    """
+    Union of overlay time windows, clipped to [0, duration].
+    """
+    spans = []
+    for ov in overlays:
+        start, end = window(ov)
+        start, end = max(0.0, start), min(duration, end)
+        if end > start:
+            spans.append((start, end))
+    merged: List[Tuple[float, float]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def plan_segments(windows: List[Tuple[float, float]], keyframes: List[float], duration: float
+                  ) -> List[Dict[str, Any]]:
+    """
+    Widen each window out to the surrounding keyframes and fill the gaps with
+    copy segments. Returns [{"start", "end", "encode"}] covering [0, duration].
+    """
+    kfs = sorted(k for k in keyframes if 0 <= k < duration)
+    if not kfs or kfs[0] > 0:
+        kfs = [0.0] + kfs
+
+    snapped: List[Tuple[float, float]] = []
+    for start, end in windows:
+        s = max((k for k in kfs if k <= start), default=0.0)
+        e = min((k for k in kfs if k >= end), default=duration)
+        if snapped and s <= snapped[-1][1]:
+            snapped[-1] = (snapped[-1][0], max(snapped[-1][1], e))
+        else:
+            snapped.append((s, e))
+
+    plan = []
+    pos = 0.0
+    for s, e in snapped:
+        if s > pos:
+            plan.append({"start": pos, "end": s, "encode": False})
+        plan.append({"start": s, "end": e, "encode": True})
+        pos = e
+    if pos < duration:
+        plan.append({"start": pos, "end": duration, "encode": False})
+    return plan
+
+
+def shift_overlays(overlays: List[Dict[str, Any]], offset: float, length: float) -> List[Dict[str, Any]]:
+    """
+    Overlays visible within [offset, offset + length], with their times made
+    relative to offset.
+    """
+    shifted = []
+    for ov in overlays:
+        start, end = window(ov)
+        if end <= offset or start >= offset + length:
+            continue
+        ov = dict(ov)
+        ov["start_time"] = round(max(0.0, start - offset), 6)
+        ov["end_time"] = round(min(length, end - offset), 6)
+        shifted.append(ov)
+    return shifted
+
+
+def plan_for(input_video: Path, overlays: List[Dict[str, Any]], duration: float,
+             probe: Optional[Dict[str, Any]], force: bool = False) -> Optional[List[Dict[str, Any]]]:
+    """
+    Segment plan for this render, or None when a plain full render is the
+    better (or only) choice, including when re-encoded segments could not
+    match the source's stream parameters.
+    """
+    if not overlays or not duration or not probe or probe.get("codec") not in SEGMENT_CODECS:
+        return None
+    if matching_encode_args(probe) is None:
+        return None
+    windows = overlay_windows(overlays, duration)
+    if not windows:
+        return None
+    keyframes = ffprobe_keyframes(input_video)
+    if not keyframes:
+        return None
+    plan = plan_segments(windows, keyframes, duration)
+    if not any(not seg["encode"] for seg in plan):
+        return None
+    encoded = sum(seg["end"] - seg["start"] for seg in plan if seg["encode"])
+    if not force and encoded / duration > SEGMENT_MAX_FRACTION:
+        return None
+    return plan
+
+
+def render_segmented(input_video: Path, overlays: List[Dict[str, Any]], jobdir: Path, out_path: Path,
+                     plan: List[Dict[str, Any]], probe: Optional[Dict[str, Any]], logf, thread_args: List[str],
+                     on_start: Callable, on_progress: Callable[..., None],
+                     is_cancelled: Callable[[], bool]) -> int:
+    """
+    Render each planned segment, then concat. on_progress(pct, stats) gets
+    overall progress plus the current ffmpeg's stats. Returns the first
+    non-zero ffmpeg exit code, or the concat exit code.
+    """
+    segdir = jobdir / "segments"
+    shutil.rmtree(segdir, ignore_errors=True)
+    segdir.mkdir()
+
+    weights = [(seg["end"] - seg["start"]) * (1.0 if seg["encode"] else COPY_WEIGHT) for seg in plan]
+    total = sum(weights) or 1.0
+    done = 0.0
+    parts = []
+    video_args = matching_encode_args(probe)
+
+    for i, seg in enumerate(plan):
+        if is_cancelled():
+            return -1
+        length = seg["end"] - seg["start"]
+        part = segdir / f"seg_{i:04d}.ts"
+        if seg["encode"]:
+            cmd = build_render_cmd(
+                input_video, shift_overlays(overlays, seg["start"], length), jobdir, part,
+                thread_args=thread_args, seek=(seg["start"], length), out_args=TS_ARGS, probe=probe,
+                video_args=video_args,
+            )
+        else:
+            cmd = [
+                "ffmpeg", "-y", "-ss", f"{seg['start']:.6f}", "-t", f"{length:.6f}", "-i", str(input_video),
+                "-map", "0:v", "-map", "0:a?", "-c", "copy", *TS_ARGS, str(part),
+            ]
+
+        base, weight = done, weights[i]
+
+        def on_stats(stats, base=base, weight=weight, length=length):
+            t_sec = stats.get("out_time") or 0.0
+            frac = min(1.0, t_sec / length) if length > 0 else 1.0
+            on_progress(min(99, int((base + frac * weight) / total * 100)), stats)
+
+        rc = run_ffmpeg(cmd, logf, on_stats=on_stats, on_start=on_start)
+        if rc != 0:
+            return rc
+        parts.append(part)
+        done += weight
+        on_progress(min(99, int(done / total * 100)))
+
+    if is_cancelled():
+        return -1
+    list_file = segdir / "concat.txt"
+    write_concat_list(list_file, parts)
+    rc = run_ffmpeg(concat_copy_cmd(list_file, out_path, MP4_ARGS), logf, on_start=on_start)
+    if rc == 0:
+        shutil.rmtree(segdir, ignore_errors=True)
+    return rc
@@ -0,0 +1,130 @@
+import re
+
+import pytest
+
+from filtergraph import MERGE_MAX_AREA_RATIO, compile_overlays
+
+
+@pytest.fixture
+def jobdir(tmp_path):
+    for name in ("a.png", "b.png", "c.png", "clip.mp4"):
+        (tmp_path / name).write_bytes(b"x")
+    return tmp_path
+
+
+def image(id, content, x, y, w=100, h=100, start=0, end=5):
+    return {"id": id, "type": "image", "content": content, "x": x, "y": y,
+            "width": w, "height": h, "start_time": start, "end_time": end}
+
+
+def video(id, start=2, end=6, x=0, y=0):
+    return {"id": id, "type": "video", "content": "clip.mp4", "x": x, "y": y,
+            "width": 160, "height": 90, "start_time": start, "end_time": end}
+
+
+def inputs(g):
+    return [g.input_args[i + 1] for i, a in enumerate(g.input_args) if a == "-i"]
+
+
+def test_video_trimmed_at_input_and_shifted(jobdir):
+    g = compile_overlays([video("v", start=2, end=6)], jobdir, input_seek=10.0)
+    assert g.input_args == ["-ss", "12", "-t", "4", "-i", str(jobdir / "clip.mp4")]
+    assert "setpts=PTS-STARTPTS+2/TB" in g.filter_complex
+    assert "between(t,2,6)" in g.filter_complex
+
+
+def test_video_window_clamped_to_duration(jobdir):
+    g = compile_overlays([video("v", start=2, end=20)], jobdir, duration=8.0)
+    assert g.input_args[:4] == ["-ss", "2", "-t", "6"]
+
+
+def test_images_prescaled_to_rgba(jobdir):
+    g = compile_overlays([image("a", "a.png", 0, 0, w=64, h=32)], jobdir)
+    assert "[1:v]scale=64:32,format=rgba[img1]" in g.filter_parts
+
+
+def test_adjacent_images_merged(jobdir):
+    ovs = [image("a", "a.png", 0, 0), image("b", "b.png", 100, 0)]
+    g = compile_overlays(ovs, jobdir)
+    assert "color=c=black@0.0:s=200x100" in g.filter_complex
+    assert g.filter_complex.count("enable=") == 1
+
+
+def test_distant_images_not_merged(jobdir):
+    # bounding box 1000x100 vs 2 x 100x100 of content
+    assert 1000 * 100 > 2 * 100 * 100 * MERGE_MAX_AREA_RATIO
+    ovs = [image("a", "a.png", 0, 0), image("b", "b.png", 900, 0)]
+    g = compile_overlays(ovs, jobdir)
+    assert "color=" not in g.filter_complex
+    assert g.filter_complex.count("enable=") == 2
+
+
+def test_images_with_different_windows_not_merged(jobdir):
+    ovs = [image("a", "a.png", 0, 0, end=5), image("b", "b.png", 100, 0, end=6)]
+    g = compile_overlays(ovs, jobdir)
+    assert "color=" not in g.filter_complex
+
+
+def test_list_order_is_z_order(jobdir):
+    ovs = [image("a", "a.png", 0, 0), video("b", start=0, end=5), image("c", "c.png", 100, 0)]
+    g = compile_overlays(ovs, jobdir)
+    # images separated by a video stay separate layers, drawn around it
+    assert "color=" not in g.filter_complex
+    assert inputs(g) == [str(jobdir / n) for n in ("a.png", "clip.mp4", "c.png")]
+    overlays = [p for p in g.filter_parts if "overlay=" in p]
+    assert [re.search(r"\]\[(\w+)\]overlay", p).group(1) for p in overlays] == ["img1", "vid3", "img5"]
+
+
+def test_text_drawn_before_media(jobdir):
+    text = {"id": "t", "type": "text", "content": "hi", "start_time": 0, "end_time": 5}
+    ovs = [image("a", "a.png", 0, 0), dict(text, id="t1"), dict(text, id="t2"), video("v1"), video("v2")]
+    g = compile_overlays(ovs, jobdir)
+    assert "drawtext" in g.filter_parts[0] and "drawtext" in g.filter_parts[1]
+    assert inputs(g) == [str(jobdir / n) for n in ("a.png", "clip.mp4", "clip.mp4")]
+    overlays = [p for p in g.filter_parts if "overlay=" in p]
+    assert [re.search(r"\]\[(\w+)\]overlay", p).group(1) for p in overlays] == ["img3", "vid5", "vid7"]
+
+
+def test_text_between_images_does_not_split_merge(jobdir):
+    text = {"id": "t", "type": "text", "content": "hi", "start_time": 0, "end_time": 5}
+    ovs = [image("a", "a.png", 0, 0), text, image("b", "b.png", 100, 0)]
+    g = compile_overlays(ovs, jobdir)
+    assert "drawtext" in g.filter_parts[0]
+    assert "color=c=black@0.0:s=200x100" in g.filter_complex
+
+
+def test_culling_reasons(jobdir):
+    ovs = [
+        image("late", "a.png", 0, 0, start=20, end=25),
+        image("off", "a.png", 2000, 0),
+        image("left", "a.png", -200, 0),
+        image("empty", "a.png", 0, 0, start=3, end=3),
+        image("missing", "nope.png", 0, 0),
+        {"id": "blank", "type": "video", "content": "", "start_time": 0, "end_time": 5},
+    ]
+    g = compile_overlays(ovs, jobdir, duration=10.0, frame=(1280, 720))
+    assert dict(g.skipped) == {
+        "late": "starts after end of video",
+        "off": "outside frame",
+        "left": "outside frame",
+        "empty": "empty time window",
+        "missing": "file missing",
+        "blank": "file missing",
+    }
+    assert g.filter_parts == []
+    assert g.out_label == "[0:v]"
+
+
+def test_prefix_keeps_labels_unique(jobdir):
+    ovs = [image("a", "a.png", 0, 0), video("v")]
+    g0 = compile_overlays(ovs, jobdir, base_label="[base0]", prefix="v0")
+    g1 = compile_overlays(ovs, jobdir, base_label="[base1]", prefix="v1", input_offset=1 + g0.num_inputs)
+
+    def outputs(g):
+        return re.findall(r"\[(\w+)\](?:;|$)", g.filter_complex + ";")
+
+    labels = outputs(g0) + outputs(g1)
+    assert len(labels) == len(set(labels))
+    assert all(l.startswith("v0") for l in outputs(g0))
+    assert all(l.startswith("v1") for l in outputs(g1))
+    assert "[3:v]" in g1.filter_complex and "[4:v]" in g1.filter_complex
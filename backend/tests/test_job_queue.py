@@ -0,0 +1,168 @@
+import threading
+import time
+
+import pytest
+
+from job_queue import SqliteJobQueue
+from scheduler import RenderScheduler
+
+LEASE = 0.2
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SqliteJobQueue(tmp_path / "queue.db", max_attempts=2)
+
+
+def expire():
+    time.sleep(LEASE + 0.05)
+
+
+def test_claims_by_priority_then_fifo(queue):
+    queue.enqueue("low", priority=0, queued_at=1)
+    queue.enqueue("early", priority=5, queued_at=2)
+    queue.enqueue("late", priority=5, queued_at=3)
+    claimed = [queue.claim("h:1:a", LEASE)[0] for _ in range(4)]
+    assert claimed == ["early", "late", "low", None]
+
+
+def test_leased_job_not_claimed_twice(queue):
+    queue.enqueue("a")
+    assert queue.claim("h:1:a", LEASE)[0] == "a"
+    assert queue.claim("h:2:b", LEASE)[0] is None
+    assert queue.counts() == {"queued": 0, "running": 1}
+
+
+def test_expired_lease_is_reclaimed_and_old_worker_loses_it(queue):
+    queue.enqueue("a")
+    queue.claim("h:1:a", LEASE)
+    expire()
+    assert queue.claim("h:2:b", LEASE)[0] == "a"
+    assert queue.heartbeat("a", "h:1:a", LEASE) == "lost"
+    assert queue.heartbeat("a", "h:2:b", LEASE) == "ok"
+
+
+def test_heartbeat_keeps_lease(queue):
+    queue.enqueue("a")
+    queue.claim("h:1:a", LEASE)
+    for _ in range(3):
+        time.sleep(LEASE / 2)
+        assert queue.heartbeat("a", "h:1:a", LEASE) == "ok"
+    assert queue.claim("h:2:b", LEASE)[0] is None
+
+
+def test_gives_up_after_max_attempts(queue):
+    queue.enqueue("a")
+    queue.claim("h:1:a", LEASE)
+    expire()
+    assert queue.claim("h:2:b", LEASE) == ("a", [])
+    expire()
+    assert queue.claim("h:3:c", LEASE) == (None, [("a", False)])
+    assert queue.position("a") == {}
+
+
+def test_release_removes_only_own_lease(queue):
+    queue.enqueue("a")
+    queue.claim("h:1:a", LEASE)
+    queue.release("a", "h:2:b")
+    assert queue.counts()["running"] == 1
+    queue.release("a", "h:1:a")
+    assert queue.counts() == {"queued": 0, "running": 0}
+
+
+def test_cancel_waiting_job_dequeues(queue):
+    queue.enqueue("a")
+    assert queue.request_cancel("a") == "dequeued"
+    assert queue.claim("h:1:a", LEASE)[0] is None
+    assert queue.request_cancel("a") is None
+
+
+def test_cancel_leased_job_signals_worker(queue):
+    queue.enqueue("a")
+    queue.claim("h:1:a", LEASE)
+    assert queue.request_cancel("a") == "signalled"
+    assert queue.heartbeat("a", "h:1:a", LEASE) == "cancel"
+
+
+def test_cancelled_job_of_dead_worker_is_dropped(queue):
+    queue.enqueue("a")
+    queue.claim("h:1:a", LEASE)
+    queue.request_cancel("a")
+    expire()
+    assert queue.claim("h:2:b", LEASE) == (None, [("a", True)])
+
+
+def test_host_limit_counts_live_leases_per_host(queue):
+    for job_id in "abcd":
+        queue.enqueue(job_id)
+    assert queue.claim("h:1:a", LEASE, host_limit=2)[0] == "a"
+    assert queue.claim("h:2:b", LEASE, host_limit=2)[0] == "b"
+    assert queue.claim("h:3:c", LEASE, host_limit=2)[0] is None
+    assert queue.claim("other:1:a", LEASE, host_limit=2)[0] == "c"
+    assert queue.host_leases("h:9:z") == 2
+    queue.release("a", "h:1:a")
+    assert queue.claim("h:3:c", LEASE, host_limit=2)[0] == "d"
+
+
+def test_check_host_rejects_second_host(queue):
+    queue.enqueue("a")
+    queue.claim("elsewhere:1:a", LEASE)
+    queue.check_host("elsewhere")
+    with pytest.raises(RuntimeError):
+        queue.check_host("here")
+    expire()
+    queue.check_host("here")
+
+
+def test_schedulers_on_one_host_share_the_render_cap(queue):
+    running, peak = set(), [0]
+    lock, gate = threading.Lock(), threading.Event()
+
+    def target(job_id, threads):
+        with lock:
+            running.add(job_id)
+            peak[0] = max(peak[0], len(running))
+        gate.wait(5)
+        with lock:
+            running.discard(job_id)
+
+    # two processes' schedulers, one render slot for the host
+    schedulers = [RenderScheduler(target=target, queue=queue, workers=1, threads_per_job=1) for _ in range(2)]
+    for s in schedulers:
+        s.start()
+    schedulers[0].submit("a")
+    schedulers[1].submit("b")
+    time.sleep(1.5)
+    assert peak[0] == 1
+    gate.set()
+    deadline = time.time() + 5
+    while queue.counts() != {"queued": 0, "running": 0} and time.time() < deadline:
+        time.sleep(0.1)
+    assert queue.counts() == {"queued": 0, "running": 0}
+    assert peak[0] == 1
+
+
+def test_borrowed_slots_count_against_host_limit(queue):
+    for job_id in "abc":
+        queue.enqueue(job_id)
+    assert queue.claim("h:1:a", LEASE, host_limit=4)[0] == "a"
+    assert queue.reserve_slots("a", "h:1:a", 3, host_limit=4) == 3
+    assert queue.host_leases("h:2:b") == 4
+    assert queue.claim("h:2:b", LEASE, host_limit=4)[0] is None
+    assert queue.reserve_slots("a", "h:1:a", 0, host_limit=4) == 0
+    assert queue.claim("h:2:b", LEASE, host_limit=4)[0] == "b"
+    # only what is free is lent
+    assert queue.reserve_slots("a", "h:1:a", 3, host_limit=4) == 2
+    assert queue.claim("h:3:c", LEASE, host_limit=4)[0] is None
+    queue.release("a", "h:1:a")
+    assert queue.claim("h:3:c", LEASE, host_limit=4)[0] == "c"
+
+
+def test_reclaim_resets_borrowed_slots(queue):
+    queue.enqueue("a")
+    queue.claim("h:1:a", LEASE, host_limit=4)
+    queue.reserve_slots("a", "h:1:a", 3, host_limit=4)
+    expire()
+    assert queue.claim("h:2:b", LEASE, host_limit=4)[0] == "a"
+    assert queue.host_leases("h:2:b") == 1
+    assert queue.reserve_slots("a", "h:1:a", 3, host_limit=4) == 0
@@ -0,0 +1,275 @@
+# uploads.py
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sessions are only locked within one process
+    fcntl = None
+
+import aiofiles
+
+import assets
+
+# bytes read from the client per iteration; memory per upload stays at this size
+CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+UPLOADS_DIR = Path("uploads")
+UPLOADS_DIR.mkdir(exist_ok=True)
+
+# upload sessions untouched for this long are deleted
+UPLOAD_SESSION_MAX_AGE = float(os.environ.get("UPLOAD_SESSION_MAX_AGE", str(24 * 3600)))
+
+_fallback_lock = threading.Lock()
+
+
+async def stream_to_file(up, target: Path, on_chunk=None) -> int:
+    """
+    Copy an UploadFile to disk CHUNK_SIZE bytes at a time without blocking
+    the event loop. Returns the number of bytes written.
+    """
+    written = 0
+    async with aiofiles.open(target, "wb") as wf:
+        while True:
+            chunk = await up.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if on_chunk is not None:
+                on_chunk(chunk)
+            await wf.write(chunk)
+            written += len(chunk)
+    return written
+
+
+# ------------------------------
+# resumable chunked uploads: init -> PUT chunk(s) at offset -> finalize
+# ------------------------------
+# Chunks of one upload may reach different API processes. Data is written
+# in place at its offset; meta.json (the received ranges) is only changed
+# under an exclusive flock on the session's lock file.
+
+def _session_dir(upload_id: str) -> Optional[Path]:
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        return None
+    return UPLOADS_DIR / upload_id
+
+
+@contextmanager
+def _session_lock(sdir: Path):
+    try:
+        f = (sdir / "lock").open("a")
+    except FileNotFoundError:
+        raise KeyError(sdir.name)
+    with f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+        else:
+            with _fallback_lock:
+                yield
+
+
+def _read_meta(sdir: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads((sdir / "meta.json").read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(sdir: Path, meta: Dict[str, Any]):
+    tmp = sdir / f"meta.{os.getpid()}.{threading.get_ident()}.tmp"
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    tmp.replace(sdir / "meta.json")
+
+
+def _update_meta(sdir: Path, change: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """
+    Locked read-modify-write of a session's meta.json. change() may raise to
+    abort without writing. Raises KeyError if the session is gone.
+    """
+    with _session_lock(sdir):
+        meta = _read_meta(sdir)
+        if meta is None:
+            raise KeyError(sdir.name)
+        change(meta)
+        _write_meta(sdir, meta)
+        return meta
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """
+    Merge [start, end) byte ranges into a sorted, non-overlapping list.
+    """
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(received: List[List[int]], size: int) -> List[List[int]]:
+    missing = []
+    pos = 0
+    for start, end in received:
+        if start > pos:
+            missing.append([pos, start])
+        pos = max(pos, end)
+    if pos < size:
+        missing.append([pos, size])
+    return missing
+
+
+def describe(upload_id: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "upload_id": upload_id,
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "received": meta["received"],
+        "missing": missing_ranges(meta["received"], meta["size"]),
+        "finalized": meta.get("finalized", False),
+        "sha256": meta.get("sha256"),
+    }
+
+
+def expire_sessions(max_age: float = UPLOAD_SESSION_MAX_AGE):
+    """
+    Delete sessions (finalized or not) that have not been touched for
+    max_age seconds, so abandoned uploads do not keep their data files.
+    """
+    cutoff = time.time() - max_age
+    for sdir in UPLOADS_DIR.iterdir():
+        meta_path = sdir / "meta.json"
+        try:
+            if not sdir.is_dir() or _session_dir(sdir.name) is None or meta_path.stat().st_mtime >= cutoff:
+                continue
+            with _session_lock(sdir):
+                if meta_path.stat().st_mtime >= cutoff:
+                    continue
+                meta_path.unlink()
+                (sdir / "data").unlink(missing_ok=True)
+            shutil.rmtree(sdir, ignore_errors=True)
+            print(f"Expired upload session {sdir.name}")
+        except (FileNotFoundError, KeyError):
+            continue  # claimed or expired by another process meanwhile
+
+
+async def init_upload(filename: str, size: int, content_type: str = "") -> Dict[str, Any]:
+    await asyncio.to_thread(expire_sessions)
+    upload_id = str(uuid.uuid4())
+    sdir = UPLOADS_DIR / upload_id
+    sdir.mkdir(parents=True)
+    meta = {
+        "filename": os.path.basename(filename),
+        "size": int(size),
+        "content_type": content_type,
+        "received": [],
+        "finalized": False,
+    }
+    # pre-size the data file so chunks can land in any order
+    async with aiofiles.open(sdir / "data", "wb") as f:
+        if size:
+            await f.seek(size - 1)
+            await f.write(b"\0")
+    _write_meta(sdir, meta)
+    return describe(upload_id, meta)
+
+
+async def write_chunk(upload_id: str, offset: int, stream) -> Dict[str, Any]:
+    """
+    Write a request body stream at the given offset. Raises KeyError for an
+    unknown upload and ValueError for a chunk outside the declared size.
+    """
+    sdir = _session_dir(upload_id)
+    if sdir is None:
+        raise KeyError(upload_id)
+    meta = _read_meta(sdir)
+    if meta is None:
+        raise KeyError(upload_id)
+    if meta.get("finalized"):
+        raise ValueError("upload already finalized")
+    if offset < 0 or offset > meta["size"]:
+        raise ValueError("offset outside upload size")
+
+    pos = offset
+    try:
+        async with aiofiles.open(sdir / "data", "r+b") as f:
+            await f.seek(offset)
+            async for chunk in stream:
+                if not chunk:
+                    continue
+                if pos + len(chunk) > meta["size"]:
+                    raise ValueError("chunk extends past upload size")
+                await f.write(chunk)
+                pos += len(chunk)
+    except FileNotFoundError:
+        raise KeyError(upload_id)
+    if pos == offset:
+        return describe(upload_id, meta)
+
+    def add_range(current: Dict[str, Any]):
+        if current.get("finalized"):
+            raise ValueError("upload already finalized")
+        current["received"] = merge_ranges(current["received"] + [[offset, pos]])
+
+    meta = await asyncio.to_thread(_update_meta, sdir, add_range)
+    return describe(upload_id, meta)
+
+
+async def get_upload(upload_id: str) -> Optional[Dict[str, Any]]:
+    sdir = _session_dir(upload_id)
+    if sdir is None:
+        return None
+    meta = _read_meta(sdir)
+    return describe(upload_id, meta) if meta else None
+
+
+async def finalize_upload(upload_id: str) -> Dict[str, Any]:
+    """
+    Mark a fully received upload as ready to attach to a job.
+    Raises KeyError if unknown, ValueError if chunks are still missing.
+    """
+    sdir = _session_dir(upload_id)
+    if sdir is None:
+        raise KeyError(upload_id)
+
+    def finalize(meta: Dict[str, Any]):
+        if missing_ranges(meta["received"], meta["size"]):
+            raise ValueError("upload incomplete")
+        if not meta.get("finalized"):
+            meta["sha256"] = assets.hash_file(sdir / "data")
+        meta["finalized"] = True
+
+    meta = await asyncio.to_thread(_update_meta, sdir, finalize)
+    return describe(upload_id, meta)
+
+
+def claim_upload(upload_id: str) -> Tuple[str, str, str]:
+    """
+    Move a finalized upload into the asset store and drop the session.
+    Returns (filename, declared content type, sha256).
+    """
+    sdir = _session_dir(upload_id)
+    if sdir is None:
+        raise KeyError(upload_id)
+    with _session_lock(sdir):
+        meta = _read_meta(sdir)
+        if meta is None:
+            raise KeyError(upload_id)
+        if not meta.get("finalized"):
+            raise ValueError(f"upload {upload_id} not finalized")
+        sha = assets.ingest(sdir / "data", meta.get("sha256"))
+        (sdir / "meta.json").unlink()
+    shutil.rmtree(sdir, ignore_errors=True)
+    return meta["filename"], meta.get("content_type", ""), sha
@@ -0,0 +1,23 @@
+# worker.py
+#
+# Render tier without the HTTP API. Run any number of these on the same
+# host as the API servers (started with RENDER_ROLE=api); they share jobs/,
+# assets/ and the SQLite job database, which cannot be shared across hosts:
+#
+#   python worker.py
+import os
+import time
+
+os.environ["RENDER_ROLE"] = "worker"
+
+import main  # noqa: E402
+
+
+if __name__ == "__main__":
+    main.start_background()
+    print(f"Render worker {main.scheduler.worker_id} waiting for jobs")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass